@@ -14,6 +14,7 @@
 # -----------------------------------------------------------------------------
 
 import enum
+import functools
 import hashlib
 
 
@@ -22,35 +23,75 @@ FAMILY_VERSION = '0.1'
 NAMESPACE = hashlib.sha512(FAMILY_NAME.encode('utf-8')).hexdigest()[:6]
 AGENT_PREFIX = '00'
 RECORD_PREFIX = '01'
+RECORD_HISTORY_PREFIX = '02'
+OWNER_HISTORY_INFIX = '00'
+LOCATION_HISTORY_INFIX = '01'
+
+# Addresses are derived from the same keys many times over while building
+# and applying a transaction, so recently derived addresses are cached
+ADDRESS_CACHE_SIZE = 16384
 
 
 @enum.unique
 class AddressSpace(enum.IntEnum):
     AGENT = 0
     RECORD = 1
+    RECORD_HISTORY = 2
 
     OTHER_FAMILY = 100
 
 
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
 def get_agent_address(public_key):
     return NAMESPACE + AGENT_PREFIX + hashlib.sha512(
         public_key.encode('utf-8')).hexdigest()[:62]
 
 
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
 def get_record_address(record_id):
     return NAMESPACE + RECORD_PREFIX + hashlib.sha512(
         record_id.encode('utf-8')).hexdigest()[:62]
 
 
-def get_address_type(address):
-    if address[:len(NAMESPACE)] != NAMESPACE:
-        return AddressSpace.OTHER_FAMILY
+def get_agent_addresses(public_keys):
+    """Returns the addresses of several agents, in the order of their keys
+    """
+    return [get_agent_address(public_key) for public_key in public_keys]
+
+
+def get_record_addresses(record_ids):
+    """Returns the addresses of several records, in the order of their ids
+    """
+    return [get_record_address(record_id) for record_id in record_ids]
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def get_record_history_prefix(record_id):
+    """Returns the address prefix shared by every history chunk of a record,
+    suitable for declaring as a transaction input or output
+    """
+    return NAMESPACE + RECORD_HISTORY_PREFIX + hashlib.sha512(
+        record_id.encode('utf-8')).hexdigest()[:54]
 
-    infix = address[6:8]
 
-    if infix == '00':
-        return AddressSpace.AGENT
-    if infix == '01':
-        return AddressSpace.RECORD
+def get_owner_history_address(record_id, index):
+    return get_record_history_prefix(record_id) + OWNER_HISTORY_INFIX + \
+        '{:06x}'.format(index)
 
-    return AddressSpace.OTHER_FAMILY
+
+def get_location_history_address(record_id, index):
+    return get_record_history_prefix(record_id) + LOCATION_HISTORY_INFIX + \
+        '{:06x}'.format(index)
+
+
+_ADDRESS_TYPES = {
+    NAMESPACE + AGENT_PREFIX: AddressSpace.AGENT,
+    NAMESPACE + RECORD_PREFIX: AddressSpace.RECORD,
+    NAMESPACE + RECORD_HISTORY_PREFIX: AddressSpace.RECORD_HISTORY,
+}
+_TYPE_PREFIX_LENGTH = len(NAMESPACE) + len(AGENT_PREFIX)
+
+
+def get_address_type(address):
+    return _ADDRESS_TYPES.get(
+        address[:_TYPE_PREFIX_LENGTH], AddressSpace.OTHER_FAMILY)
@@ -0,0 +1,55 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import random
+import time
+
+from simple_supply_addressing import addresser
+
+
+def run(opts):
+    """Compares address derivation throughput with and without the address
+    cache, for a workload drawing repeatedly from a fixed set of keys
+    """
+    rng = random.Random(opts.seed)
+    keys = ['{:066x}'.format(rng.getrandbits(264)) for _ in range(opts.keys)]
+    workload = [rng.choice(keys) for _ in range(opts.lookups)]
+
+    uncached = addresser.get_agent_address.__wrapped__
+    results = [
+        ('uncached', lambda: [uncached(key) for key in workload]),
+        ('cached', lambda: [
+            addresser.get_agent_address(key) for key in workload]),
+        ('batch', lambda: addresser.get_agent_addresses(workload)),
+    ]
+
+    print('{} lookups over {} distinct keys'.format(
+        opts.lookups, opts.keys))
+    for name, derive in results:
+        addresser.get_agent_address.cache_clear()
+        start = time.perf_counter()
+        derive()
+        elapsed = time.perf_counter() - start
+        print('{:>10}: {:>12,.0f} addresses/sec'.format(
+            name, opts.lookups / elapsed))
+
+    address = addresser.get_agent_address(keys[0])
+    count = opts.lookups
+    start = time.perf_counter()
+    for _ in range(count):
+        addresser.get_address_type(address)
+    elapsed = time.perf_counter() - start
+    print('{:>10}: {:>12,.0f} lookups/sec'.format(
+        'type', count / elapsed))
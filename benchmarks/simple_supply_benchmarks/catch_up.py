@@ -0,0 +1,119 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import time
+
+from sawtooth_sdk.protobuf.events_pb2 import Event
+from sawtooth_sdk.protobuf.events_pb2 import EventList
+from sawtooth_sdk.protobuf.transaction_receipt_pb2 import StateChange
+from sawtooth_sdk.protobuf.transaction_receipt_pb2 import StateChangeList
+
+from simple_supply_addressing import addresser
+from simple_supply_protobuf import record_pb2
+
+from simple_supply_subscriber.event_handling import BlockApplier
+from simple_supply_subscriber.event_handling import decode_events
+from simple_supply_subscriber.event_handling import get_events_handler
+from simple_supply_subscriber.pipeline import Pipeline
+
+from simple_supply_benchmarks.db_inserts import connect_scratch_database
+
+
+SUBSCRIBER_TABLES = [
+    'blocks', 'agents', 'records', 'record_locations', 'record_owners',
+    'agents_current', 'records_current']
+
+
+def run(opts):
+    """Times indexing a backlog of blocks into Postgres, as the subscriber
+    does while catching up with the validator: one block at a time, with
+    the pipelined subscriber, and with it committing groups of blocks. The
+    subscriber tables of the target database are truncated before every
+    run, so point it at a scratch database.
+    """
+    messages = [
+        _make_event_list(block_num, opts.history)
+        for block_num in range(opts.blocks)
+    ]
+
+    modes = [
+        ('serial', None),
+        ('pipelined', 1),
+        ('grouped', opts.commit_blocks),
+    ]
+
+    print('{:>10}  {:>10}  {:>10}  {:>12}'.format(
+        'mode', 'blocks', 'seconds', 'blocks/sec'))
+    for mode, group_size in modes:
+        seconds = _time_catch_up(opts, group_size, messages)
+        print('{:>10}  {:>10}  {:>10.3f}  {:>12,.0f}'.format(
+            mode, len(messages), seconds, len(messages) / seconds))
+
+
+def _time_catch_up(opts, group_size, messages):
+    database = connect_scratch_database(opts.dsn, SUBSCRIBER_TABLES)
+    try:
+        start = time.perf_counter()
+        if group_size is not None:
+            pipeline = Pipeline(
+                [decode_events, BlockApplier(database, group_size)],
+                queue_size=opts.queue_size)
+            pipeline.start()
+            _receive(messages, pipeline.put)
+            pipeline.stop()
+        else:
+            _receive(messages, get_events_handler(database))
+        return time.perf_counter() - start
+
+    finally:
+        database.disconnect()
+
+
+def _receive(messages, handler):
+    for message in messages:
+        event_list = EventList()
+        event_list.ParseFromString(message)
+        handler(event_list.events)
+
+
+def _make_event_list(block_num, history):
+    record_id = 'record-{}'.format(block_num)
+    record = record_pb2.Record(
+        record_id=record_id,
+        owners=[record_pb2.Record.Owner(
+            agent_id='{:066x}'.format(block_num), timestamp=block_num)],
+        locations=[
+            record_pb2.Record.Location(
+                latitude=i, longitude=-i, timestamp=block_num + i)
+            for i in range(history)
+        ])
+    container = record_pb2.RecordContainer(entries=[record])
+    changes = StateChangeList(state_changes=[StateChange(
+        address=addresser.get_record_address(record_id),
+        value=container.SerializeToString(),
+        type=StateChange.SET)])
+
+    return EventList(events=[
+        Event(
+            event_type='sawtooth/block-commit',
+            attributes=[
+                Event.Attribute(key='block_num', value=str(block_num)),
+                Event.Attribute(
+                    key='block_id', value='{:0128x}'.format(block_num)),
+            ]),
+        Event(
+            event_type='sawtooth/state-delta',
+            data=changes.SerializeToString()),
+    ]).SerializeToString()
@@ -0,0 +1,76 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import time
+
+from simple_supply_protobuf import record_pb2
+
+from simple_supply_tp.container import IndexedContainer
+
+
+ENTRY_COUNTS = [1, 10, 100, 1000]
+
+
+def run(opts):
+    """Times updating one record at an address shared by many others, as
+    in adversarial inputs that load an address with colliding entries
+    """
+    print('{:>8}  {:>14}  {:>14}'.format('entries', 'full parse', 'indexed'))
+    for entry_count in ENTRY_COUNTS:
+        data = _make_container(entry_count, opts.history).SerializeToString()
+        record_id = 'record-{}'.format(entry_count // 2)
+        timings = [
+            _time(_update_parsed, data, record_id, opts.iterations),
+            _time(_update_indexed, data, record_id, opts.iterations),
+        ]
+        print('{:>8}  {:>11.1f} us  {:>11.1f} us'.format(
+            entry_count, *timings))
+
+
+def _make_container(entry_count, history):
+    locations = [
+        record_pb2.Record.Location(latitude=i, longitude=i, timestamp=i)
+        for i in range(history)
+    ]
+    return record_pb2.RecordContainer(entries=[
+        record_pb2.Record(
+            record_id='record-{}'.format(i),
+            current_owner='{:066x}'.format(i),
+            locations=locations)
+        for i in range(entry_count)
+    ])
+
+
+def _update_parsed(data, record_id):
+    container = record_pb2.RecordContainer()
+    container.ParseFromString(data)
+    for record in container.entries:
+        if record.record_id == record_id:
+            record.locations.add(latitude=1, longitude=1, timestamp=1)
+    return container.SerializeToString()
+
+
+def _update_indexed(data, record_id):
+    container = IndexedContainer(record_pb2.Record, 'record_id', data)
+    container.get(record_id).locations.add(
+        latitude=1, longitude=1, timestamp=1)
+    return container.serialize()
+
+
+def _time(update, data, record_id, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        update(data, record_id)
+    return (time.perf_counter() - start) / iterations * 1e6
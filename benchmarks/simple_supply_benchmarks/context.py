@@ -0,0 +1,90 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import time
+
+from sawtooth_sdk.protobuf.state_context_pb2 import TpStateEntry
+
+
+class InMemoryContext(object):
+    """Stand-in for the SDK's Context which keeps global state in a dict,
+    so transaction handlers can be exercised without a validator. Each call
+    can optionally sleep to simulate the round trip to the validator.
+
+    Args:
+        latency (float): Seconds to wait on every context request
+        state (dict): Initial global state, as address to data
+    """
+    # Methods take the same arguments as the SDK's Context, which handlers
+    # may pass by keyword, whether or not they are used here
+    # pylint: disable=unused-argument
+
+    def __init__(self, latency=0, state=None):
+        self.latency = latency
+        self._state = dict(state or {})
+        self.get_state_calls = 0
+        self.set_state_calls = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def get_state(self, addresses, timeout=None):
+        self._round_trip()
+        self.get_state_calls += 1
+        entries = [
+            TpStateEntry(address=address, data=self._state[address])
+            for address in addresses
+            if self._state.get(address)
+        ]
+        self.bytes_read += sum(len(entry.data) for entry in entries)
+        return entries
+
+    def set_state(self, entries, timeout=None):
+        self._round_trip()
+        self.set_state_calls += 1
+        self.bytes_written += sum(len(data) for data in entries.values())
+        self._state.update(entries)
+        return list(entries)
+
+    def delete_state(self, addresses, timeout=None):
+        self._round_trip()
+        deleted = [address for address in addresses if address in self._state]
+        for address in deleted:
+            del self._state[address]
+        return deleted
+
+    def add_receipt_data(self, data, timeout=None):
+        self._round_trip()
+
+    def add_event(self, event_type, attributes=None, data=None, timeout=None):
+        self._round_trip()
+
+    def reset_counters(self):
+        self.get_state_calls = 0
+        self.set_state_calls = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    @property
+    def state(self):
+        """A copy of the global state, as a dict of address to data"""
+        return dict(self._state)
+
+    @property
+    def state_size(self):
+        return sum(len(data) for data in self._state.values())
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
@@ -0,0 +1,109 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import time
+
+import psycopg2
+
+from simple_supply_subscriber.database import Database
+from simple_supply_subscriber.decoding import Record
+
+
+HISTORY_TABLES = [
+    'records', 'record_locations', 'record_owners', 'records_current']
+
+
+def run(opts):
+    """Times indexing history-heavy blocks into Postgres at each batch
+    size. The history tables of the target database are truncated before
+    every run, so point it at a scratch database.
+    """
+    print('{:>10}  {:>10}  {:>10}  {:>12}'.format(
+        'batch size', 'rows', 'seconds', 'rows/sec'))
+    for batch_size in opts.batch_sizes:
+        rows, seconds = _time_blocks(opts, batch_size)
+        print('{:>10}  {:>10}  {:>10.3f}  {:>12,.0f}'.format(
+            batch_size, rows, seconds, rows / seconds))
+
+
+def _time_blocks(opts, batch_size):
+    database = connect_scratch_database(
+        opts.dsn, HISTORY_TABLES, batch_size=batch_size)
+    try:
+        rows = 0
+        start = time.perf_counter()
+        for block_num in range(opts.blocks):
+            for record_index in range(opts.records):
+                record = _make_record(
+                    '{}-{}'.format(block_num, record_index), opts.history)
+                database.insert_record(record, block_num)
+                rows += 1 + len(record.locations) + len(record.owners)
+            database.commit()
+        return rows, time.perf_counter() - start
+
+    finally:
+        database.disconnect()
+
+
+def connect_scratch_database(dsn, tables, **kwargs):
+    """Connects to a database, migrating it to the latest schema version and
+    emptying the given tables
+
+    Args:
+        dsn (str): The connection string for the database
+        tables (list of str): The tables to truncate
+        kwargs: Passed on to the Database
+
+    Returns:
+        Database: The connected database
+    """
+    database = Database(dsn, **kwargs)
+    database.connect()
+    try:
+        database.migrate()
+        truncate_tables(dsn, tables)
+    except Exception:
+        database.disconnect()
+        raise
+    return database
+
+
+def truncate_tables(dsn, tables):
+    execute_statements(dsn, 'TRUNCATE {}'.format(', '.join(tables)))
+
+
+def execute_statements(dsn, statements):
+    """Runs and commits statements on a connection of their own
+    """
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(statements)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _make_record(record_id, history):
+    locations = [(i, -i, i) for i in range(history)]
+    owners = [
+        ('{:066x}'.format(i), i) for i in range(max(history // 100, 1))
+    ]
+    return Record(
+        'record-{}'.format(record_id),
+        owners,
+        locations,
+        len(owners),
+        len(locations))
@@ -0,0 +1,104 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import functools
+import time
+
+from simple_supply_addressing import addresser
+from simple_supply_protobuf import agent_pb2
+from simple_supply_protobuf import record_pb2
+
+from simple_supply_subscriber.decoding import deserialize_data
+
+
+def run(opts):
+    """Times decoding state deltas into rows, as the subscriber does for
+    every changed container, against parsing the containers alone
+    """
+    deltas = [
+        ('agents', addresser.get_agent_address('agent'),
+         agent_pb2.AgentContainer, _make_agents(opts.entries)),
+        ('records', addresser.get_record_address('record'),
+         record_pb2.RecordContainer, _make_records(opts.entries, False)),
+        ('packed', addresser.get_record_address('record'),
+         record_pb2.RecordContainer, _make_records(opts.entries, True)),
+    ]
+
+    print('{:>8}  {:>10}  {:>14}  {:>14}'.format(
+        'delta', 'bytes', 'parse ms/MB', 'decode ms/MB'))
+    for name, address, container, data in deltas:
+        iterations = max(int(opts.megabytes * 1e6 / len(data)), 1)
+        megabytes = len(data) * iterations / 1e6
+        parse = _time(
+            functools.partial(container.FromString, data), iterations)
+        decode = _time(
+            functools.partial(deserialize_data, address, data), iterations)
+        print('{:>8}  {:>10,}  {:>14.1f}  {:>14.1f}'.format(
+            name,
+            len(data),
+            parse / megabytes * 1000,
+            decode / megabytes * 1000))
+
+
+def _make_agents(count):
+    return agent_pb2.AgentContainer(entries=[
+        agent_pb2.Agent(
+            public_key='{:066x}'.format(i),
+            name='agent-{}'.format(i),
+            timestamp=1500000000 + i)
+        for i in range(count)
+    ]).SerializeToString()
+
+
+def _make_records(count, packed):
+    records = []
+    for i in range(count):
+        record = record_pb2.Record(
+            record_id='record-{}'.format(i),
+            owners=[
+                record_pb2.Record.Owner(
+                    agent_id='{:066x}'.format(j), timestamp=1500000000 + j)
+                for j in range(10)
+            ])
+        locations = [
+            (45000000 + j * 10, -122000000 - j * 10, 1500000000 + j * 60)
+            for j in range(100)
+        ]
+        if packed:
+            record.layout_version = 1
+            record.owner_count = len(record.owners)
+            record.location_count = len(locations)
+            columns = record.packed_locations
+            previous = (0, 0, 0)
+            for location in locations:
+                columns.latitude_deltas.append(location[0] - previous[0])
+                columns.longitude_deltas.append(location[1] - previous[1])
+                columns.timestamp_deltas.append(location[2] - previous[2])
+                previous = location
+        else:
+            record.locations.extend(
+                record_pb2.Record.Location(
+                    latitude=latitude, longitude=longitude, timestamp=stamp)
+                for latitude, longitude, stamp in locations)
+        records.append(record)
+
+    return record_pb2.RecordContainer(entries=records).SerializeToString()
+
+
+def _time(function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return time.perf_counter() - start
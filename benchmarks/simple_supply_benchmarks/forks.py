@@ -0,0 +1,107 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import statistics
+import time
+
+from simple_supply_subscriber.migrations import CREATE_FORK_INDEX_STMTS
+from simple_supply_subscriber.migrations import INSERT_CURRENT_RECORDS_STMTS
+from simple_supply_subscriber.migrations import MAX_BLOCK_NUMBER
+from simple_supply_subscriber.migrations import VERSIONED_TABLES
+
+from simple_supply_benchmarks.catch_up import SUBSCRIBER_TABLES
+from simple_supply_benchmarks.db_inserts import connect_scratch_database
+from simple_supply_benchmarks.db_inserts import execute_statements
+
+
+FORK_DEPTHS = [1, 10, 100]
+
+# Each block appends locations to every record and replaces its records row
+POPULATE_STMTS = """
+INSERT INTO blocks (block_num, block_id)
+SELECT b, to_char(b, 'FM0000000000') FROM generate_series(0, {blocks} - 1) b;
+
+INSERT INTO records (record_id, start_block_num, end_block_num)
+SELECT 'record-' || r, b,
+CASE WHEN b = {blocks} - 1 THEN {max} ELSE b + 1 END
+FROM generate_series(0, {blocks} - 1) b, generate_series(1, {records}) r;
+
+INSERT INTO record_locations (
+record_id, latitude, longitude, timestamp, start_block_num, end_block_num)
+SELECT 'record-' || r, l, -l, b, b, {max}
+FROM generate_series(0, {blocks} - 1) b,
+generate_series(1, {records}) r,
+generate_series(1, {locations}) l;
+"""
+
+
+def run(opts):
+    """Times rolling back forks of several depths from the head of a large
+    history. Every rollback is itself rolled back, so each depth runs
+    against the same tables. The subscriber tables of the target database
+    are truncated and repopulated first, so point it at a scratch database.
+    """
+    database = connect_scratch_database(opts.dsn, SUBSCRIBER_TABLES)
+    try:
+        rows = _populate(opts)
+        if opts.without_indexes:
+            _drop_fork_indexes(opts)
+
+        print('{} history rows over {} blocks'.format(rows, opts.blocks))
+        print('{:>10}  {:>12}'.format('depth', 'median ms'))
+        for depth in FORK_DEPTHS:
+            print('{:>10}  {:>12.2f}'.format(
+                depth, _time_drop_fork(database, opts, depth) * 1000))
+
+        if opts.without_indexes:
+            _create_fork_indexes(opts)
+
+    finally:
+        database.disconnect()
+
+
+def _populate(opts):
+    execute_statements(opts.dsn, POPULATE_STMTS.format(
+        blocks=opts.blocks,
+        records=opts.records,
+        locations=opts.locations,
+        max=MAX_BLOCK_NUMBER))
+    execute_statements(opts.dsn, INSERT_CURRENT_RECORDS_STMTS.format(
+        MAX_BLOCK_NUMBER, 'TRUE'))
+    execute_statements(opts.dsn, 'ANALYZE')
+    return opts.blocks * opts.records * (opts.locations + 1)
+
+
+def _drop_fork_indexes(opts):
+    execute_statements(opts.dsn, ''.join(
+        'DROP INDEX IF EXISTS {0}_start_block_num_idx, '
+        '{0}_end_block_num_idx;'.format(table)
+        for table in VERSIONED_TABLES))
+
+
+def _create_fork_indexes(opts):
+    execute_statements(opts.dsn, ''.join(
+        CREATE_FORK_INDEX_STMTS.format(table, MAX_BLOCK_NUMBER)
+        for table in VERSIONED_TABLES))
+
+
+def _time_drop_fork(database, opts, depth):
+    timings = []
+    for _ in range(opts.iterations):
+        start = time.perf_counter()
+        database.drop_fork(opts.blocks - depth)
+        timings.append(time.perf_counter() - start)
+        database.rollback()
+    return statistics.median(timings)
@@ -0,0 +1,88 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import random
+import time
+
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+
+from simple_supply_tp.handler import SimpleSupplyHandler
+
+from simple_supply_benchmarks.context import InMemoryContext
+from simple_supply_benchmarks.stats import percentile
+from simple_supply_benchmarks.workloads import WORKLOADS
+
+
+def run(opts):
+    """Applies generated workloads to a SimpleSupplyHandler backed by an
+    in-memory context and reports throughput, latency and state usage
+    """
+    names = sorted(WORKLOADS) if opts.workload == 'all' else [opts.workload]
+
+    print('{:<16}{:>8}{:>12}{:>10}{:>10}{:>14}{:>10}{:>10}'.format(
+        'workload', 'txns', 'txns/sec', 'p50 ms', 'p99 ms',
+        'bytes written', 'gets/txn', 'sets/txn'))
+    for name in names:
+        result = run_workload(
+            name, opts.count, latency=opts.latency / 1000, seed=opts.seed)
+        print('{:<16}{:>8}{:>12,.0f}{:>10.3f}{:>10.3f}{:>14,}'
+              '{:>10.2f}{:>10.2f}'.format(
+                  name,
+                  result['count'],
+                  result['count'] / result['elapsed'],
+                  result['p50'] * 1000,
+                  result['p99'] * 1000,
+                  result['bytes_written'],
+                  result['get_state_calls'] / result['count'],
+                  result['set_state_calls'] / result['count']))
+        if result['invalid']:
+            print('  {} transactions were invalid'.format(result['invalid']))
+
+
+def run_workload(name, count, latency=0, seed=0):
+    setup, transactions = WORKLOADS[name](count, random.Random(seed))
+
+    handler = SimpleSupplyHandler()
+    context = InMemoryContext()
+    for transaction in setup:
+        handler.apply(transaction, context)
+
+    # Only the measured transactions pay the simulated round trips
+    context.latency = latency
+    context.reset_counters()
+
+    timings = []
+    invalid = 0
+    start = time.perf_counter()
+    for transaction in transactions:
+        applied = time.perf_counter()
+        try:
+            handler.apply(transaction, context)
+        except InvalidTransaction:
+            invalid += 1
+        timings.append(time.perf_counter() - applied)
+    elapsed = time.perf_counter() - start
+
+    timings.sort()
+    return {
+        'count': len(transactions),
+        'elapsed': elapsed,
+        'p50': percentile(timings, 50),
+        'p99': percentile(timings, 99),
+        'invalid': invalid,
+        'bytes_written': context.bytes_written,
+        'get_state_calls': context.get_state_calls,
+        'set_state_calls': context.set_state_calls,
+    }
@@ -0,0 +1,265 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import argparse
+import sys
+
+from simple_supply_benchmarks.workloads import WORKLOADS
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description='Runs Simple Supply performance benchmarks')
+
+    subparsers = parser.add_subparsers(title='benchmarks', dest='benchmark')
+    subparsers.required = True
+
+    owner_parser = subparsers.add_parser(
+        'owner-lookup',
+        help='Time transferring a record as its ownership chain grows')
+    owner_parser.add_argument(
+        '-n', '--iterations',
+        type=int,
+        default=1000,
+        help='Number of transfers to time per chain length')
+    owner_parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed for generating the workload')
+
+    addressing_parser = subparsers.add_parser(
+        'addressing',
+        help='Measure address derivation throughput')
+    addressing_parser.add_argument(
+        '-k', '--keys',
+        type=int,
+        default=1000,
+        help='Number of distinct keys to derive addresses for')
+    addressing_parser.add_argument(
+        '-n', '--lookups',
+        type=int,
+        default=200000,
+        help='Number of addresses to derive')
+    addressing_parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed for generating the workload')
+
+    containers_parser = subparsers.add_parser(
+        'containers',
+        help='Time updating one entry of a crowded state container')
+    containers_parser.add_argument(
+        '-n', '--iterations',
+        type=int,
+        default=100,
+        help='Number of updates to time per container size')
+    containers_parser.add_argument(
+        '--history',
+        type=int,
+        default=8,
+        help='Number of locations held by each record')
+
+    handler_parser = subparsers.add_parser(
+        'handler',
+        help='Measure SimpleSupplyHandler throughput with in-memory state')
+    handler_parser.add_argument(
+        'workload',
+        nargs='?',
+        choices=sorted(WORKLOADS) + ['all'],
+        default='all',
+        help='The workload to run')
+    handler_parser.add_argument(
+        '-n', '--count',
+        type=int,
+        default=1000,
+        help='Number of transactions to apply per workload')
+    handler_parser.add_argument(
+        '-l', '--latency',
+        type=float,
+        default=0,
+        help='Simulated validator round trip per state request, in ms')
+    handler_parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed for generating the workload')
+
+    decoding_parser = subparsers.add_parser(
+        'decoding',
+        help='Measure the subscriber decoding state deltas into rows')
+    decoding_parser.add_argument(
+        '-e', '--entries',
+        type=int,
+        default=100,
+        help='Number of agents or records in each decoded container')
+    decoding_parser.add_argument(
+        '-m', '--megabytes',
+        type=float,
+        default=20,
+        help='Megabytes of state deltas to decode per container type')
+
+    db_inserts_parser = subparsers.add_parser(
+        'db-inserts',
+        help='Measure subscriber indexing of history-heavy blocks')
+    db_inserts_parser.add_argument(
+        '--dsn',
+        default='dbname=simple-supply-bench user=sawtooth '
+                'password=sawtooth host=localhost port=5432',
+        help='Connection string of a scratch database to write to')
+    db_inserts_parser.add_argument(
+        '-b', '--blocks',
+        type=int,
+        default=20,
+        help='Number of blocks to index')
+    db_inserts_parser.add_argument(
+        '-r', '--records',
+        type=int,
+        default=5,
+        help='Number of records changed per block')
+    db_inserts_parser.add_argument(
+        '--history',
+        type=int,
+        default=5000,
+        help='Number of locations held by each record')
+    db_inserts_parser.add_argument(
+        '--batch-sizes',
+        type=lambda sizes: [int(size) for size in sizes.split(',')],
+        default=[1, 100, 1000],
+        help='Comma separated batch sizes to compare')
+
+    catch_up_parser = subparsers.add_parser(
+        'catch-up',
+        help='Compare the serial and pipelined subscriber catching up')
+    catch_up_parser.add_argument(
+        '--dsn',
+        default='dbname=simple-supply-bench user=sawtooth '
+                'password=sawtooth host=localhost port=5432',
+        help='Connection string of a scratch database to write to')
+    catch_up_parser.add_argument(
+        '-b', '--blocks',
+        type=int,
+        default=2000,
+        help='Number of blocks to index')
+    catch_up_parser.add_argument(
+        '--history',
+        type=int,
+        default=20,
+        help='Number of locations held by the record changed in each block')
+    catch_up_parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=64,
+        help='Number of blocks buffered between pipeline stages')
+    catch_up_parser.add_argument(
+        '--commit-blocks',
+        type=int,
+        default=100,
+        help='Number of blocks per transaction in the grouped mode')
+
+    forks_parser = subparsers.add_parser(
+        'forks',
+        help='Time rolling back forks of the subscriber database')
+    forks_parser.add_argument(
+        '--dsn',
+        default='dbname=simple-supply-bench user=sawtooth '
+                'password=sawtooth host=localhost port=5432',
+        help='Connection string of a scratch database to write to')
+    forks_parser.add_argument(
+        '-b', '--blocks',
+        type=int,
+        default=10000,
+        help='Number of blocks of history')
+    forks_parser.add_argument(
+        '-r', '--records',
+        type=int,
+        default=20,
+        help='Number of records changed per block')
+    forks_parser.add_argument(
+        '-l', '--locations',
+        type=int,
+        default=10,
+        help='Number of locations appended to each record per block')
+    forks_parser.add_argument(
+        '-n', '--iterations',
+        type=int,
+        default=5,
+        help='Number of rollbacks to time per fork depth')
+    forks_parser.add_argument(
+        '--without-indexes',
+        action='store_true',
+        help='Drop the fork indexes while timing, for comparison')
+
+    rest_load_parser = subparsers.add_parser(
+        'rest-load',
+        help='Measure REST API throughput as concurrent clients increase')
+    rest_load_parser.add_argument(
+        '--url',
+        default='http://localhost:8000',
+        help='The url of a running Simple Supply REST API')
+    rest_load_parser.add_argument(
+        '--paths',
+        type=lambda paths: paths.split(','),
+        default=['/agents', '/records'],
+        help='Comma separated paths to request in turn')
+    rest_load_parser.add_argument(
+        '-c', '--clients',
+        type=lambda clients: [int(count) for count in clients.split(',')],
+        default=[1, 4, 16, 64],
+        help='Comma separated numbers of concurrent clients to compare')
+    rest_load_parser.add_argument(
+        '-d', '--duration',
+        type=float,
+        default=10,
+        help='Number of seconds to send requests for at each concurrency')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+
+    # Benchmarks are imported as they are run, so that those which only need
+    # the processor don't require the database and HTTP client packages
+    if opts.benchmark == 'owner-lookup':
+        from simple_supply_benchmarks import owner_lookup
+        owner_lookup.run(opts)
+    elif opts.benchmark == 'addressing':
+        from simple_supply_benchmarks import addressing
+        addressing.run(opts)
+    elif opts.benchmark == 'containers':
+        from simple_supply_benchmarks import containers
+        containers.run(opts)
+    elif opts.benchmark == 'handler':
+        from simple_supply_benchmarks import handler
+        handler.run(opts)
+    elif opts.benchmark == 'decoding':
+        from simple_supply_benchmarks import decoding
+        decoding.run(opts)
+    elif opts.benchmark == 'db-inserts':
+        from simple_supply_benchmarks import db_inserts
+        db_inserts.run(opts)
+    elif opts.benchmark == 'catch-up':
+        from simple_supply_benchmarks import catch_up
+        catch_up.run(opts)
+    elif opts.benchmark == 'forks':
+        from simple_supply_benchmarks import forks
+        forks.run(opts)
+    elif opts.benchmark == 'rest-load':
+        from simple_supply_benchmarks import rest_load
+        rest_load.run(opts)
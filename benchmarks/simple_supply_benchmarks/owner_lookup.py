@@ -0,0 +1,73 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import random
+import statistics
+import time
+
+from simple_supply_tp.handler import SimpleSupplyHandler
+
+from simple_supply_benchmarks.context import InMemoryContext
+from simple_supply_benchmarks.workloads import transfer_storm
+
+
+CHAIN_LENGTHS = [1, 10, 100, 1000, 10000]
+
+
+def run(opts):
+    """Times TRANSFER_RECORD transactions applied by a SimpleSupplyHandler
+    to a record whose ownership chain already holds each of CHAIN_LENGTHS
+    owners
+    """
+    print('{:>8}  {:>10}  {:>10}  {:>14}'.format(
+        'owners', 'p50 us', 'mean us', 'bytes read'))
+    for chain_length in CHAIN_LENGTHS:
+        timings, bytes_read = time_transfer(
+            chain_length, opts.iterations, seed=opts.seed)
+        print('{:>8}  {:>10.1f}  {:>10.1f}  {:>14,}'.format(
+            chain_length,
+            statistics.median(timings) * 1e6,
+            statistics.mean(timings) * 1e6,
+            bytes_read))
+
+
+def time_transfer(chain_length, iterations, seed=0):
+    """Builds a record with chain_length owners by transferring it back
+    and forth between two agents, then times transferring it once more
+
+    Each timed transfer is applied to a copy of the same state, so the
+    chain does not grow while it is measured.
+
+    Returns:
+        tuple: The seconds taken by each transfer, and the number of bytes
+            of state each read
+    """
+    handler = SimpleSupplyHandler()
+    context = InMemoryContext()
+    setup, transfers = transfer_storm(
+        chain_length, random.Random(seed), agent_count=2, record_count=1)
+    for transaction in setup + transfers[:-1]:
+        handler.apply(transaction, context)
+
+    state = context.state
+    transfer = transfers[-1]
+    timings = []
+    for _ in range(iterations):
+        context = InMemoryContext(state=state)
+        start = time.perf_counter()
+        handler.apply(transfer, context)
+        timings.append(time.perf_counter() - start)
+
+    return timings, context.bytes_read
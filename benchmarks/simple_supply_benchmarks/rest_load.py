@@ -0,0 +1,80 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import asyncio
+import time
+
+import aiohttp
+
+from simple_supply_benchmarks.stats import percentile
+
+
+def run(opts):
+    """Measures how the throughput and latency of a running REST API change
+    with the number of concurrent clients. Each client requests the paths
+    in turn, waiting for every response before sending the next request,
+    for the given number of seconds.
+    """
+    loop = asyncio.get_event_loop()
+
+    print('{:>8}{:>10}{:>8}{:>12}{:>10}{:>10}'.format(
+        'clients', 'requests', 'errors', 'reqs/sec', 'p50 ms', 'p99 ms'))
+    for clients in opts.clients:
+        timings, errors, elapsed = loop.run_until_complete(
+            _load(opts, clients))
+        timings.sort()
+        print('{:>8}{:>10}{:>8}{:>12,.0f}{:>10.2f}{:>10.2f}'.format(
+            clients,
+            len(timings),
+            errors,
+            len(timings) / elapsed,
+            percentile(timings, 50) * 1000,
+            percentile(timings, 99) * 1000))
+
+
+async def _load(opts, clients):
+    timings = []
+    errors = []
+    connector = aiohttp.TCPConnector(limit=clients)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        deadline = start + opts.duration
+        await asyncio.gather(*[
+            _client(session, opts, index, deadline, timings, errors)
+            for index in range(clients)
+        ])
+        elapsed = time.perf_counter() - start
+    return timings, len(errors), elapsed
+
+
+async def _client(session, opts, index, deadline, timings, errors):
+    # Clients start at different paths, so each path is requested
+    # concurrently with the others
+    request_num = index
+    while time.perf_counter() < deadline:
+        path = opts.paths[request_num % len(opts.paths)]
+        request_num += 1
+
+        sent = time.perf_counter()
+        try:
+            async with session.get(opts.url + path) as response:
+                await response.read()
+                if response.status >= 400:
+                    errors.append(response.status)
+                    continue
+        except aiohttp.ClientError as err:
+            errors.append(err)
+            continue
+        timings.append(time.perf_counter() - sent)
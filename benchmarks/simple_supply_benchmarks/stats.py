@@ -0,0 +1,25 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+
+def percentile(sorted_values, percent):
+    """Returns the value below which the given percent of the sorted values
+    fall, or 0 if there are none
+    """
+    if not sorted_values:
+        return 0
+    index = min(
+        int(len(sorted_values) * percent / 100), len(sorted_values) - 1)
+    return sorted_values[index]
@@ -0,0 +1,182 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import time
+
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessRequest
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+
+from simple_supply_addressing import addresser
+
+from simple_supply_protobuf import payload_pb2
+
+
+# Workloads are generated rather than signed, since the handler never looks
+# at signatures. Each workload returns the transactions needed to set up
+# state, which are applied but not measured, and the transactions to time.
+
+
+def create_agents(count, rng):
+    agents = _make_keys(count, rng)
+    return [], [_create_agent(agent) for agent in agents]
+
+
+def create_records(count, rng):
+    agent = _make_keys(1, rng)[0]
+    return (
+        [_create_agent(agent)],
+        [_create_record(agent, 'record-{}'.format(i), rng)
+         for i in range(count)])
+
+
+def update_chain(count, rng):
+    """A single record updated over and over, as a long lived shipping
+    container reporting a dense GPS trace would be
+    """
+    agent = _make_keys(1, rng)[0]
+    latitude = _random_latitude(rng)
+    longitude = _random_longitude(rng)
+
+    transactions = []
+    for _ in range(count):
+        latitude = _clamp(latitude + rng.randint(-500, 500), 90000000)
+        longitude = _clamp(longitude + rng.randint(-500, 500), 180000000)
+        transactions.append(
+            _update_record(agent, 'chain', latitude, longitude))
+
+    return (
+        [_create_agent(agent), _create_record(agent, 'chain', rng)],
+        transactions)
+
+
+def transfer_storm(count, rng, agent_count=10, record_count=10):
+    """Records passed back and forth at random between a group of agents
+    """
+    agents = _make_keys(agent_count, rng)
+    record_ids = ['storm-{}'.format(i) for i in range(record_count)]
+    owners = {record_id: agents[0] for record_id in record_ids}
+
+    setup = [_create_agent(agent) for agent in agents]
+    setup.extend(
+        _create_record(agents[0], record_id, rng) for record_id in record_ids)
+
+    transactions = []
+    for _ in range(count):
+        record_id = rng.choice(record_ids)
+        receiving_agent = rng.choice(
+            [agent for agent in agents if agent != owners[record_id]])
+        transactions.append(
+            _transfer_record(owners[record_id], receiving_agent, record_id))
+        owners[record_id] = receiving_agent
+
+    return setup, transactions
+
+
+WORKLOADS = {
+    'create-agents': create_agents,
+    'create-records': create_records,
+    'update-chain': update_chain,
+    'transfer-storm': transfer_storm,
+}
+
+
+def _make_keys(count, rng):
+    return ['02{:064x}'.format(rng.getrandbits(256)) for _ in range(count)]
+
+
+def _create_agent(agent):
+    address = addresser.get_agent_address(agent)
+    return _make_request(
+        signer=agent,
+        inputs=[address],
+        outputs=[address],
+        action=payload_pb2.SimpleSupplyPayload.CREATE_AGENT,
+        create_agent=payload_pb2.CreateAgentAction(name='benchmark'))
+
+
+def _create_record(agent, record_id, rng):
+    record_address = addresser.get_record_address(record_id)
+    return _make_request(
+        signer=agent,
+        inputs=[addresser.get_agent_address(agent), record_address],
+        outputs=[record_address],
+        action=payload_pb2.SimpleSupplyPayload.CREATE_RECORD,
+        create_record=payload_pb2.CreateRecordAction(
+            record_id=record_id,
+            latitude=_random_latitude(rng),
+            longitude=_random_longitude(rng)))
+
+
+def _update_record(agent, record_id, latitude, longitude):
+    record_address = addresser.get_record_address(record_id)
+    history_prefix = addresser.get_record_history_prefix(record_id)
+    return _make_request(
+        signer=agent,
+        inputs=[
+            addresser.get_agent_address(agent),
+            record_address,
+            history_prefix
+        ],
+        outputs=[record_address, history_prefix],
+        action=payload_pb2.SimpleSupplyPayload.UPDATE_RECORD,
+        update_record=payload_pb2.UpdateRecordAction(
+            record_id=record_id,
+            latitude=latitude,
+            longitude=longitude))
+
+
+def _transfer_record(agent, receiving_agent, record_id):
+    record_address = addresser.get_record_address(record_id)
+    history_prefix = addresser.get_record_history_prefix(record_id)
+    return _make_request(
+        signer=agent,
+        inputs=[
+            addresser.get_agent_address(agent),
+            addresser.get_agent_address(receiving_agent),
+            record_address,
+            history_prefix
+        ],
+        outputs=[record_address, history_prefix],
+        action=payload_pb2.SimpleSupplyPayload.TRANSFER_RECORD,
+        transfer_record=payload_pb2.TransferRecordAction(
+            record_id=record_id,
+            receiving_agent=receiving_agent))
+
+
+def _make_request(signer, inputs, outputs, **payload_fields):
+    payload = payload_pb2.SimpleSupplyPayload(
+        timestamp=int(time.time()), **payload_fields)
+    header = TransactionHeader(
+        family_name=addresser.FAMILY_NAME,
+        family_version=addresser.FAMILY_VERSION,
+        inputs=inputs,
+        outputs=outputs,
+        signer_public_key=signer,
+        batcher_public_key=signer)
+    return TpProcessRequest(
+        header=header,
+        payload=payload.SerializeToString())
+
+
+def _random_latitude(rng):
+    return rng.randint(-90000000, 90000000)
+
+
+def _random_longitude(rng):
+    return rng.randint(-180000000, 180000000)
+
+
+def _clamp(value, limit):
+    return max(-limit, min(value, limit))
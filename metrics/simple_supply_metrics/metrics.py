@@ -0,0 +1,268 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import bisect
+import contextlib
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+import logging
+import threading
+import time
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the buckets used for timing histograms
+TIME_BUCKETS = [
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5
+]
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, quantile):
+        """Returns the upper bound of the bucket containing the quantile
+        """
+        target = quantile * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+
+class Metrics(object):
+    """Thread-safe collection of named counters, gauges and timing
+    histograms. Metrics are identified by a name and optional keyword
+    labels, for example the action a transaction performed.
+
+    Args:
+        prefix (str): Prepended to the name of every exported metric
+    """
+    def __init__(self, prefix=''):
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._last_summary = (time.monotonic(), {})
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def get(self, name, default=0, **labels):
+        """Returns the current value of a gauge
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            return self._gauges.get(key, default)
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(TIME_BUCKETS)
+            self._histograms[key].observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format
+        """
+        prefix = self._prefix
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append('{}{} {}'.format(
+                    prefix + name, _format_labels(labels), value))
+
+            for (name, labels), value in sorted(self._gauges.items()):
+                lines.append('{}{} {}'.format(
+                    prefix + name, _format_labels(labels), value))
+
+            for (name, labels), histogram in sorted(
+                    self._histograms.items(), key=lambda item: item[0]):
+                cumulative = 0
+                for bound, count in zip(
+                        histogram.buckets + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(
+                        prefix + name,
+                        _format_labels(labels + (('le', bound),)),
+                        cumulative))
+                lines.append('{}_sum{} {}'.format(
+                    prefix + name, _format_labels(labels), histogram.total))
+                lines.append('{}_count{} {}'.format(
+                    prefix + name, _format_labels(labels), histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Returns a one line summary of the metrics for logging. Counters
+        are shown with their rate per second since the previous summary.
+        """
+        parts = []
+        with self._lock:
+            now = time.monotonic()
+            last_time, last_counters = self._last_summary
+            elapsed = max(now - last_time, 1e-9)
+            self._last_summary = (now, dict(self._counters))
+
+            for key, value in sorted(self._counters.items()):
+                name, labels = key
+                parts.append('{}{}={} ({:.1f}/s)'.format(
+                    name,
+                    _format_labels(labels),
+                    value,
+                    (value - last_counters.get(key, 0)) / elapsed))
+
+            for (name, labels), value in sorted(self._gauges.items()):
+                parts.append('{}{}={}'.format(
+                    name, _format_labels(labels), value))
+
+            for (name, labels), histogram in sorted(
+                    self._histograms.items(), key=lambda item: item[0]):
+                parts.append('{}{}: n={} avg={:.2f}ms p99<={:.2f}ms'.format(
+                    name,
+                    _format_labels(labels),
+                    histogram.count,
+                    histogram.total / histogram.count * 1000,
+                    histogram.quantile(0.99) * 1000))
+
+        return ', '.join(parts)
+
+
+class NullMetrics(object):
+    """Metrics which discard everything, used when metrics are disabled
+    """
+    def increment(self, name, value=1, **labels):
+        pass
+
+    def set(self, name, value, **labels):
+        pass
+
+    def get(self, _name, default=0, **_labels):
+        return default
+
+    def observe(self, name, seconds, **labels):
+        pass
+
+    def timer(self, _name, **_labels):
+        return _NULL_TIMER
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def start_metrics_server(metrics, host, port):
+    """Serves the metrics at http://host:port/metrics from a daemon thread
+    """
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=W0622
+            LOGGER.debug(format, *args)
+
+    server = HTTPServer((host, port), MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    LOGGER.info('Serving metrics on http://%s:%s/metrics', host, port)
+    return server
+
+
+def start_metrics_logging(metrics, interval):
+    """Logs a summary of the metrics every interval seconds from a daemon
+    thread
+    """
+    def log_metrics():
+        while True:
+            time.sleep(interval)
+            LOGGER.info('Metrics: %s', metrics.summary())
+
+    thread = threading.Thread(target=log_metrics, daemon=True)
+    thread.start()
+    return thread
+
+
+def start_metrics(opts, prefix, port_offset=0):
+    """Starts exporting metrics as configured by the metrics_bind and
+    metrics_interval options, returning the Metrics to record to, or None if
+    metrics are disabled
+
+    Args:
+        opts (argparse.Namespace): The parsed command line options
+        prefix (str): Prepended to the name of every exported metric
+        port_offset (int): Added to the port metrics are served on, so that
+            several processes on one host can each serve their own
+    """
+    if not opts.metrics_bind and not opts.metrics_interval:
+        return None
+
+    metrics = Metrics(prefix=prefix)
+    if opts.metrics_bind:
+        host, port = opts.metrics_bind.rsplit(':', 1)
+        start_metrics_server(metrics, host, int(port) + port_offset)
+    if opts.metrics_interval:
+        start_metrics_logging(metrics, opts.metrics_interval)
+    return metrics
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(key, value) for key, value in labels) + '}'
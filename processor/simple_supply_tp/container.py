@@ -0,0 +1,126 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import bisect
+
+
+# Every container message has a single field, "repeated <Entry> entries = 1",
+# and every entry has its key as the string field numbered 1
+_ENTRIES_TAG = (1 << 3) | 2
+_KEY_TAG = (1 << 3) | 2
+
+
+class IndexedContainer(object):
+    """A parsed state container whose entries are kept sorted by key.
+
+    Entries are split out of the serialized container without being parsed,
+    and are only parsed when they are looked up. Lookups and insertions use
+    a binary search over the keys, and entries which were never parsed are
+    written back using their original bytes, so the cost of changing one
+    entry does not depend on how many other entries share its address.
+
+    Args:
+        entry_class (type): The protobuf class of the container's entries
+        key_field (str): Name of the entry field the container is keyed by
+        data (bytes): The serialized container, if any
+    """
+    def __init__(self, entry_class, key_field, data=None):
+        self._entry_class = entry_class
+        self._key_field = key_field
+        self._keys = []
+        self._entries = []
+
+        if data:
+            # Containers written before entries were sorted are sorted once
+            # here and written back in order
+            entries = sorted(self._split(data), key=lambda entry: entry[0])
+            self._keys = [key for key, _ in entries]
+            self._entries = [raw for _, raw in entries]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, key):
+        """Returns the entry with the given key, or None if there is none.
+        The entry is written back with the container, so it may be modified.
+        """
+        index = bisect.bisect_left(self._keys, key)
+        if index == len(self._keys) or self._keys[index] != key:
+            return None
+
+        entry = self._entries[index]
+        if isinstance(entry, bytes):
+            entry = self._entry_class.FromString(entry)
+            self._entries[index] = entry
+        return entry
+
+    def add(self, entry):
+        """Inserts an entry in key order
+        """
+        key = getattr(entry, self._key_field)
+        index = bisect.bisect_right(self._keys, key)
+        self._keys.insert(index, key)
+        self._entries.insert(index, entry)
+
+    def serialize(self):
+        parts = []
+        for entry in self._entries:
+            if not isinstance(entry, bytes):
+                entry = entry.SerializeToString()
+            parts.append(_encode_varint(_ENTRIES_TAG))
+            parts.append(_encode_varint(len(entry)))
+            parts.append(entry)
+        return b''.join(parts)
+
+    def _split(self, data):
+        position = 0
+        while position < len(data):
+            tag, position = _decode_varint(data, position)
+            length, position = _decode_varint(data, position)
+            raw = data[position:position + length]
+            position += length
+            if tag == _ENTRIES_TAG:
+                yield self._read_key(raw), raw
+
+    def _read_key(self, raw):
+        # Fields are serialized in field number order, so the key is read
+        # straight from the front of the entry without parsing the rest
+        if raw and raw[0] == _KEY_TAG:
+            length, position = _decode_varint(raw, 1)
+            return raw[position:position + length].decode('utf-8')
+
+        entry = self._entry_class.FromString(raw)
+        return getattr(entry, self._key_field)
+
+
+def _decode_varint(data, position):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def _encode_varint(value):
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
@@ -17,12 +17,15 @@ import datetime
 import time
 
 from sawtooth_sdk.processor.handler import TransactionHandler
+from sawtooth_sdk.processor.exceptions import AuthorizationException
 from sawtooth_sdk.processor.exceptions import InvalidTransaction
 
 from simple_supply_addressing import addresser
 
 from simple_supply_protobuf import payload_pb2
 
+from simple_supply_metrics.metrics import NullMetrics
+
 from simple_supply_tp.payload import SimpleSupplyPayload
 from simple_supply_tp.state import SimpleSupplyState
 
@@ -35,6 +38,14 @@ MIN_LNG = -180 * 1e6
 
 
 class SimpleSupplyHandler(TransactionHandler):
+    """Transaction handler for the Simple Supply family
+
+    Args:
+        metrics (Metrics): Where to record per-action counts and timings,
+            or None to disable metrics
+    """
+    def __init__(self, metrics=None):
+        self._metrics = NullMetrics() if metrics is None else metrics
 
     @property
     def family_name(self):
@@ -49,12 +60,40 @@ class SimpleSupplyHandler(TransactionHandler):
         return [addresser.NAMESPACE]
 
     def apply(self, transaction, context):
-        header = transaction.header
-        payload = SimpleSupplyPayload(transaction.payload)
-        state = SimpleSupplyState(context)
+        start = time.perf_counter()
+        action = 'UNKNOWN'
+        try:
+            payload = SimpleSupplyPayload(transaction.payload)
+            action = _action_name(payload.action)
+            self._apply(transaction.header, payload, context)
+        except InvalidTransaction as err:
+            self._metrics.increment(
+                'rejected_total',
+                action=action,
+                reason=getattr(err, 'reason', 'invalid'))
+            raise
+        except AuthorizationException:
+            # Reading or writing an address the transaction did not declare,
+            # such as the history of a record without its prefix
+            self._metrics.increment(
+                'rejected_total', action=action, reason='undeclared_address')
+            raise
+        finally:
+            self._metrics.observe(
+                'apply_seconds', time.perf_counter() - start, action=action)
+            self._metrics.increment('transactions_total', action=action)
+            self._metrics.increment(
+                'payload_bytes_total',
+                len(transaction.payload),
+                action=action)
+
+    def _apply(self, header, payload, context):
+        state = SimpleSupplyState(context, metrics=self._metrics)
 
         _validate_timestamp(payload.timestamp)
 
+        state.prefetch(header.inputs)
+
         if payload.action == payload_pb2.SimpleSupplyPayload.CREATE_AGENT:
             _create_agent(
                 state=state,
@@ -69,20 +108,31 @@ class SimpleSupplyHandler(TransactionHandler):
             _transfer_record(
                 state=state,
                 public_key=header.signer_public_key,
-                payload=payload)
+                action=payload.data,
+                timestamp=payload.timestamp)
         elif payload.action == payload_pb2.SimpleSupplyPayload.UPDATE_RECORD:
             _update_record(
+                state=state,
+                public_key=header.signer_public_key,
+                action=payload.data,
+                timestamp=payload.timestamp)
+        elif payload.action == payload_pb2.SimpleSupplyPayload.BATCH_UPDATE:
+            _batch_update(
                 state=state,
                 public_key=header.signer_public_key,
                 payload=payload)
         else:
-            raise InvalidTransaction('Unhandled action')
+            raise _reject('unhandled_action', 'Unhandled action')
+
+        state.flush()
 
 
 def _create_agent(state, public_key, payload):
     if state.get_agent(public_key):
-        raise InvalidTransaction('Agent with the public key {} already '
-                                 'exists'.format(public_key))
+        raise _reject(
+            'agent_exists',
+            'Agent with the public key {} already '
+            'exists'.format(public_key))
     state.set_agent(
         public_key=public_key,
         name=payload.data.name,
@@ -91,15 +141,19 @@ def _create_agent(state, public_key, payload):
 
 def _create_record(state, public_key, payload):
     if state.get_agent(public_key) is None:
-        raise InvalidTransaction('Agent with the public key {} does '
-                                 'not exist'.format(public_key))
+        raise _reject(
+            'agent_not_found',
+            'Agent with the public key {} does '
+            'not exist'.format(public_key))
 
     if payload.data.record_id == '':
-        raise InvalidTransaction('No record ID provided')
+        raise _reject('missing_record_id', 'No record ID provided')
 
     if state.get_record(payload.data.record_id):
-        raise InvalidTransaction('Identifier {} belongs to an existing '
-                                 'record'.format(payload.data.record_id))
+        raise _reject(
+            'record_exists',
+            'Identifier {} belongs to an existing '
+            'record'.format(payload.data.record_id))
 
     _validate_latlng(payload.data.latitude, payload.data.longitude)
 
@@ -111,63 +165,113 @@ def _create_record(state, public_key, payload):
         timestamp=payload.timestamp)
 
 
-def _transfer_record(state, public_key, payload):
-    if state.get_agent(payload.data.receiving_agent) is None:
-        raise InvalidTransaction(
+def _transfer_record(state, public_key, action, timestamp):
+    if state.get_agent(action.receiving_agent) is None:
+        raise _reject(
+            'agent_not_found',
             'Agent with the public key {} does '
-            'not exist'.format(payload.data.receiving_agent))
+            'not exist'.format(action.receiving_agent))
 
-    record = state.get_record(payload.data.record_id)
+    record = state.get_record(action.record_id)
     if record is None:
-        raise InvalidTransaction('Record with the record id {} does not '
-                                 'exist'.format(payload.data.record_id))
+        raise _reject(
+            'record_not_found',
+            'Record with the record id {} does not '
+            'exist'.format(action.record_id))
 
     if not _validate_record_owner(signer_public_key=public_key,
                                   record=record):
-        raise InvalidTransaction(
+        raise _reject(
+            'not_owner',
             'Transaction signer is not the owner of the record')
 
     state.transfer_record(
-        receiving_agent=payload.data.receiving_agent,
-        record_id=payload.data.record_id,
-        timestamp=payload.timestamp)
+        receiving_agent=action.receiving_agent,
+        record_id=action.record_id,
+        timestamp=timestamp)
 
 
-def _update_record(state, public_key, payload):
-    record = state.get_record(payload.data.record_id)
+def _update_record(state, public_key, action, timestamp):
+    record = state.get_record(action.record_id)
     if record is None:
-        raise InvalidTransaction('Record with the record id {} does not '
-                                 'exist'.format(payload.data.record_id))
+        raise _reject(
+            'record_not_found',
+            'Record with the record id {} does not '
+            'exist'.format(action.record_id))
 
     if not _validate_record_owner(signer_public_key=public_key,
                                   record=record):
-        raise InvalidTransaction(
+        raise _reject(
+            'not_owner',
             'Transaction signer is not the owner of the record')
 
-    _validate_latlng(payload.data.latitude, payload.data.longitude)
+    _validate_latlng(action.latitude, action.longitude)
 
     state.update_record(
-        latitude=payload.data.latitude,
-        longitude=payload.data.longitude,
-        record_id=payload.data.record_id,
-        timestamp=payload.timestamp)
+        latitude=action.latitude,
+        longitude=action.longitude,
+        record_id=action.record_id,
+        timestamp=timestamp)
+
+
+def _batch_update(state, public_key, payload):
+    if not payload.data.updates and not payload.data.transfers:
+        raise _reject('empty_batch', 'No record updates or transfers provided')
+
+    for action in payload.data.updates:
+        _update_record(
+            state=state,
+            public_key=public_key,
+            action=action,
+            timestamp=payload.timestamp)
+
+    for action in payload.data.transfers:
+        _transfer_record(
+            state=state,
+            public_key=public_key,
+            action=action,
+            timestamp=payload.timestamp)
+
+
+def _action_name(action):
+    try:
+        return payload_pb2.SimpleSupplyPayload.Action.Name(action)
+    except ValueError:
+        return 'UNKNOWN'
+
+
+def _reject(reason, message):
+    """Returns an InvalidTransaction tagged with a short reason, under which
+    the rejection is counted in the processor metrics
+    """
+    error = InvalidTransaction(message)
+    error.reason = reason
+    return error
 
 
 def _validate_record_owner(signer_public_key, record):
     """Validates that the public key of the signer is the latest (i.e.
     current) owner of the record
     """
+    if record.current_owner:
+        return record.current_owner == signer_public_key
+
+    # Records written before current_owner was introduced
     latest_owner = max(record.owners, key=lambda obj: obj.timestamp).agent_id
     return latest_owner == signer_public_key
 
 
 def _validate_latlng(latitude, longitude):
     if not MIN_LAT <= latitude <= MAX_LAT:
-        raise InvalidTransaction('Latitude must be between -90 and 90. '
-                                 'Got {}'.format(latitude/1e6))
+        raise _reject(
+            'invalid_latitude',
+            'Latitude must be between -90 and 90. '
+            'Got {}'.format(latitude/1e6))
     if not MIN_LNG <= longitude <= MAX_LNG:
-        raise InvalidTransaction('Longitude must be between -180 and 180. '
-                                 'Got {}'.format(longitude/1e6))
+        raise _reject(
+            'invalid_longitude',
+            'Longitude must be between -180 and 180. '
+            'Got {}'.format(longitude/1e6))
 
 
 def _validate_timestamp(timestamp):
@@ -180,7 +284,8 @@ def _validate_timestamp(timestamp):
     dts = datetime.datetime.utcnow()
     current_time = round(time.mktime(dts.timetuple()) + dts.microsecond/1e6)
     if (timestamp - current_time) > SYNC_TOLERANCE:
-        raise InvalidTransaction(
+        raise _reject(
+            'invalid_timestamp',
             'Timestamp must be less than local time.'
             ' Expected {0} in ({1}-{2}, {1}+{2})'.format(
                 timestamp, current_time, SYNC_TOLERANCE))
@@ -14,14 +14,33 @@
 # -----------------------------------------------------------------------------
 
 import argparse
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import signal
 import sys
+import time
 
 from sawtooth_sdk.processor.core import TransactionProcessor
 from sawtooth_sdk.processor.log import init_console_logging
 
+from simple_supply_metrics.metrics import start_metrics
+
 from simple_supply_tp.handler import SimpleSupplyHandler
 
 
+LOGGER = logging.getLogger(__name__)
+METRICS_PREFIX = 'simple_supply_tp_'
+
+# Workers which exit sooner than this after starting are restarted after a
+# delay, so a persistent failure does not turn into a fork loop
+MIN_WORKER_UPTIME = 5
+RESTART_DELAY = 5
+SHUTDOWN_TIMEOUT = 10
+SHUTDOWN_SIGNALS = {signal.SIGINT, signal.SIGTERM}
+
+
 def parse_args(args):
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawTextHelpFormatter)
@@ -31,6 +50,23 @@ def parse_args(args):
         default='tcp://localhost:4004',
         help='Endpoint for the validator connection')
 
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=1,
+        help='Number of transaction processor processes to run')
+
+    parser.add_argument(
+        '--metrics-bind',
+        help='Serve processor metrics over HTTP at host:port/metrics. With\n'
+             'several workers, each worker uses the next port up')
+
+    parser.add_argument(
+        '--metrics-interval',
+        type=float,
+        default=0,
+        help='Log a summary of processor metrics every N seconds')
+
     parser.add_argument(
         '-v', '--verbose',
         action='count',
@@ -40,16 +76,12 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
-def main(args=None):
-    if args is None:
-        args = sys.argv[1:]
-    opts = parse_args(args)
+def run_processor(opts, worker_id=0):
     processor = None
     try:
-        init_console_logging(verbose_level=opts.verbose)
-
+        metrics = start_metrics(opts, METRICS_PREFIX, worker_id)
         processor = TransactionProcessor(url=opts.connect)
-        handler = SimpleSupplyHandler()
+        handler = SimpleSupplyHandler(metrics=metrics)
         processor.add_handler(handler)
         processor.start()
     except KeyboardInterrupt:
@@ -59,3 +91,116 @@ def main(args=None):
     finally:
         if processor is not None:
             processor.stop()
+
+
+class WorkerSupervisor(object):
+    """Runs several transaction processors in separate processes, each
+    registered with the same validator. Workers which exit are restarted,
+    and SIGINT or SIGTERM shuts every worker down.
+    """
+    def __init__(self, opts):
+        self._opts = opts
+        self._workers = {}
+        self._is_active = False
+
+    def start(self):
+        self._is_active = True
+        # Installed before any worker is forked, so a signal received while
+        # they start still stops those already running
+        signal.signal(signal.SIGINT, self._handle_signal)
+        signal.signal(signal.SIGTERM, self._handle_signal)
+
+        for worker_id in range(self._opts.workers):
+            if not self._is_active:
+                break
+            self._start_worker(worker_id)
+
+        while self._is_active:
+            sentinels = [process.sentinel
+                         for process, _ in self._workers.values()]
+            wait(sentinels, timeout=1)
+            for worker_id, (process, started) in list(self._workers.items()):
+                if self._is_active and not process.is_alive():
+                    self._restart_worker(worker_id, process, started)
+
+        self._stop_workers()
+
+    def stop(self):
+        """Stops restarting workers, and makes start shut every worker down
+        and return
+        """
+        self._is_active = False
+
+    def _handle_signal(self, signum, _frame):
+        LOGGER.info('Received signal %s, stopping workers', signum)
+        self.stop()
+
+    def _start_worker(self, worker_id):
+        process = multiprocessing.Process(
+            target=_run_worker,
+            args=(self._opts, worker_id),
+            name='simple-supply-tp-{}'.format(worker_id))
+        # Signals are held while forking, so a worker only receives them once
+        # it has replaced the supervisor's handlers with its own
+        signal.pthread_sigmask(signal.SIG_BLOCK, SHUTDOWN_SIGNALS)
+        try:
+            process.start()
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, SHUTDOWN_SIGNALS)
+        LOGGER.info('Started worker %s (pid %s)', worker_id, process.pid)
+        self._workers[worker_id] = (process, time.time())
+
+    def _restart_worker(self, worker_id, process, started):
+        LOGGER.warning(
+            'Worker %s (pid %s) exited with code %s, restarting',
+            worker_id, process.pid, process.exitcode)
+        if time.time() - started < MIN_WORKER_UPTIME:
+            time.sleep(RESTART_DELAY)
+        if self._is_active:
+            self._start_worker(worker_id)
+
+    def _stop_workers(self):
+        processes = [process for process, _ in self._workers.values()]
+        for process in processes:
+            if process.is_alive():
+                # Processors unregister from the validator on SIGINT
+                _signal_process(process, signal.SIGINT)
+
+        deadline = time.time() + SHUTDOWN_TIMEOUT
+        for process in processes:
+            process.join(max(deadline - time.time(), 0))
+            if process.is_alive():
+                LOGGER.warning(
+                    'Worker %s did not stop, terminating', process.pid)
+                process.terminate()
+                process.join()
+
+
+def _run_worker(opts, worker_id):
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, SHUTDOWN_SIGNALS)
+    except KeyboardInterrupt:
+        # Stopped by the supervisor before it started
+        return
+    run_processor(opts, worker_id)
+
+
+def _signal_process(process, signum):
+    try:
+        os.kill(process.pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+    init_console_logging(verbose_level=opts.verbose)
+
+    if opts.workers > 1:
+        WorkerSupervisor(opts).start()
+    else:
+        run_processor(opts)
@@ -50,6 +50,11 @@ class SimpleSupplyPayload(object):
                 payload_pb2.SimpleSupplyPayload.UPDATE_RECORD:
             return self._transaction.update_record
 
+        if self._transaction.HasField('batch_update') and \
+            self._transaction.action == \
+                payload_pb2.SimpleSupplyPayload.BATCH_UPDATE:
+            return self._transaction.batch_update
+
         raise InvalidTransaction('Action does not match payload data')
 
     @property
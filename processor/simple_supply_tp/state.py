@@ -18,11 +18,87 @@ from simple_supply_addressing import addresser
 from simple_supply_protobuf import agent_pb2
 from simple_supply_protobuf import record_pb2
 
+from simple_supply_metrics.metrics import NullMetrics
+
+from simple_supply_tp.container import IndexedContainer
+
+
+# The entry type of each container, and the field the container is keyed by
+CONTAINERS = {
+    addresser.AddressSpace.AGENT: (agent_pb2.Agent, 'public_key'),
+    addresser.AddressSpace.RECORD: (record_pb2.Record, 'record_id'),
+    addresser.AddressSpace.RECORD_HISTORY:
+        (record_pb2.RecordHistory, 'record_id'),
+}
+ADDRESS_LENGTH = 70
+
+# Records written with the paged layout keep between RECENT_HISTORY_SIZE and
+# RECENT_HISTORY_SIZE + HISTORY_CHUNK_SIZE - 1 owners and locations inline.
+# Older entries are moved out in chunks of HISTORY_CHUNK_SIZE, so the cost of
+# an update does not depend on the age of the record.
+PAGED_LAYOUT_VERSION = 1
+HISTORY_CHUNK_SIZE = 16
+RECENT_HISTORY_SIZE = 4
+HISTORY_FIELDS = {
+    'owners': ('owner_count', addresser.get_owner_history_address),
+    'locations': ('location_count', addresser.get_location_history_address),
+}
+
 
 class SimpleSupplyState(object):
-    def __init__(self, context, timeout=2):
+    """Transaction-scoped view of Simple Supply state. Containers are read
+    from the context at most once and cached as IndexedContainers, and all
+    writes are buffered until flush() sends them in a single set_state call.
+    """
+    def __init__(self, context, timeout=2, metrics=None):
         self._context = context
         self._timeout = timeout
+        self._metrics = NullMetrics() if metrics is None else metrics
+        self._state_data = {}
+        self._containers = {}
+        self._pending = []
+
+    def prefetch(self, addresses):
+        """Reads the given addresses from state in a single request. Entries
+        which are not Simple Supply addresses, or are only address prefixes,
+        are ignored.
+
+        Args:
+            addresses (list of str): Addresses to read, typically the
+                inputs declared in the transaction header
+        """
+        addresses = [
+            address for address in set(addresses)
+            if len(address) == ADDRESS_LENGTH
+            and address not in self._state_data
+            and addresser.get_address_type(address) in CONTAINERS
+        ]
+        if not addresses:
+            return
+
+        state_entries = self._get_state(addresses)
+        data = {entry.address: entry.data for entry in state_entries}
+        for address in addresses:
+            self._state_data[address] = data.get(address)
+
+    def flush(self):
+        """Writes every container modified since the last flush to state in
+        a single request
+        """
+        if not self._pending:
+            return
+
+        updated_state = {
+            address: self._containers[address].serialize()
+            for address in self._pending
+        }
+        self._metrics.increment('set_state_calls_total')
+        self._metrics.increment(
+            'state_bytes_written_total',
+            sum(len(data) for data in updated_state.values()))
+        with self._metrics.timer('set_state_seconds'):
+            self._context.set_state(updated_state, timeout=self._timeout)
+        self._pending = []
 
     def get_agent(self, public_key):
         """Gets the agent associated with the public_key
@@ -34,16 +110,7 @@ class SimpleSupplyState(object):
             agent_pb2.Agent: Agent with the provided public_key
         """
         address = addresser.get_agent_address(public_key)
-        state_entries = self._context.get_state(
-            addresses=[address], timeout=self._timeout)
-        if state_entries:
-            container = agent_pb2.AgentContainer()
-            container.ParseFromString(state_entries[0].data)
-            for agent in container.entries:
-                if agent.public_key == public_key:
-                    return agent
-
-        return None
+        return self._get_container(address).get(public_key)
 
     def set_agent(self, public_key, name, timestamp):
         """Creates a new agent in state
@@ -56,18 +123,8 @@ class SimpleSupplyState(object):
         address = addresser.get_agent_address(public_key)
         agent = agent_pb2.Agent(
             public_key=public_key, name=name, timestamp=timestamp)
-        container = agent_pb2.AgentContainer()
-        state_entries = self._context.get_state(
-            addresses=[address], timeout=self._timeout)
-        if state_entries:
-            container.ParseFromString(state_entries[0].data)
-
-        container.entries.extend([agent])
-        data = container.SerializeToString()
-
-        updated_state = {}
-        updated_state[address] = data
-        self._context.set_state(updated_state, timeout=self._timeout)
+        self._get_container(address).add(agent)
+        self._set_container(address)
 
     def get_record(self, record_id):
         """Gets the record associated with the record_id
@@ -79,16 +136,7 @@ class SimpleSupplyState(object):
             record_pb2.Record: Record with the provided record_id
         """
         address = addresser.get_record_address(record_id)
-        state_entries = self._context.get_state(
-            addresses=[address], timeout=self._timeout)
-        if state_entries:
-            container = record_pb2.RecordContainer()
-            container.ParseFromString(state_entries[0].data)
-            for record in container.entries:
-                if record.record_id == record_id:
-                    return record
-
-        return None
+        return self._get_container(address).get(record_id)
 
     def set_record(self,
                    public_key,
@@ -116,37 +164,25 @@ class SimpleSupplyState(object):
         record = record_pb2.Record(
             record_id=record_id,
             owners=[owner],
-            locations=[location])
-        container = record_pb2.RecordContainer()
-        state_entries = self._context.get_state(
-            addresses=[address], timeout=self._timeout)
-        if state_entries:
-            container.ParseFromString(state_entries[0].data)
-
-        container.entries.extend([record])
-        data = container.SerializeToString()
-
-        updated_state = {}
-        updated_state[address] = data
-        self._context.set_state(updated_state, timeout=self._timeout)
+            locations=[location],
+            layout_version=PAGED_LAYOUT_VERSION,
+            owner_count=1,
+            location_count=1,
+            current_owner=public_key)
+        _pack_locations(record)
+        self._get_container(address).add(record)
+        self._set_container(address)
 
     def transfer_record(self, receiving_agent, record_id, timestamp):
         owner = record_pb2.Record.Owner(
             agent_id=receiving_agent,
             timestamp=timestamp)
         address = addresser.get_record_address(record_id)
-        container = record_pb2.RecordContainer()
-        state_entries = self._context.get_state(
-            addresses=[address], timeout=self._timeout)
-        if state_entries:
-            container.ParseFromString(state_entries[0].data)
-            for record in container.entries:
-                if record.record_id == record_id:
-                    record.owners.extend([owner])
-        data = container.SerializeToString()
-        updated_state = {}
-        updated_state[address] = data
-        self._context.set_state(updated_state, timeout=self._timeout)
+        record = self._get_container(address).get(record_id)
+        if record is not None:
+            record.current_owner = receiving_agent
+            self._append_history(record, 'owners', owner)
+        self._set_container(address)
 
     def update_record(self, latitude, longitude, record_id, timestamp):
         location = record_pb2.Record.Location(
@@ -154,15 +190,132 @@ class SimpleSupplyState(object):
             longitude=longitude,
             timestamp=timestamp)
         address = addresser.get_record_address(record_id)
-        container = record_pb2.RecordContainer()
-        state_entries = self._context.get_state(
-            addresses=[address], timeout=self._timeout)
-        if state_entries:
-            container.ParseFromString(state_entries[0].data)
-            for record in container.entries:
-                if record.record_id == record_id:
-                    record.locations.extend([location])
-        data = container.SerializeToString()
-        updated_state = {}
-        updated_state[address] = data
-        self._context.set_state(updated_state, timeout=self._timeout)
+        record = self._get_container(address).get(record_id)
+        if record is not None:
+            _unpack_locations(record)
+            self._append_history(record, 'locations', location)
+            _pack_locations(record)
+        self._set_container(address)
+
+    def _append_history(self, record, field, entry):
+        """Appends an owner or location to a record, upgrading records
+        written with the inline layout and paging out full history chunks
+        """
+        if record.layout_version < PAGED_LAYOUT_VERSION:
+            record.layout_version = PAGED_LAYOUT_VERSION
+            record.owner_count = len(record.owners)
+            record.location_count = len(record.locations)
+
+        count_field, _ = HISTORY_FIELDS[field]
+        getattr(record, field).extend([entry])
+        setattr(record, count_field, getattr(record, count_field) + 1)
+        self._page_history(record, field)
+
+    def _page_history(self, record, field):
+        count_field, get_address = HISTORY_FIELDS[field]
+        history = getattr(record, field)
+        chunk_count = \
+            (len(history) - RECENT_HISTORY_SIZE) // HISTORY_CHUNK_SIZE
+        if chunk_count <= 0:
+            return
+
+        first_index = (getattr(record, count_field) - len(history)) \
+            // HISTORY_CHUNK_SIZE
+        addresses = [
+            get_address(record.record_id, first_index + i)
+            for i in range(chunk_count)
+        ]
+        self.prefetch(addresses)
+
+        for i, address in enumerate(addresses):
+            chunk = record_pb2.RecordHistory(
+                record_id=record.record_id,
+                index=first_index + i)
+            getattr(chunk, field).extend(
+                history[i * HISTORY_CHUNK_SIZE:(i + 1) * HISTORY_CHUNK_SIZE])
+            _pack_locations(chunk)
+            self._get_container(address).add(chunk)
+            self._set_container(address)
+
+        del history[:chunk_count * HISTORY_CHUNK_SIZE]
+
+    def _get_container(self, address):
+        """Returns the cached container at the address, parsing it on first
+        use. Addresses which were not prefetched are read individually.
+        """
+        try:
+            return self._containers[address]
+        except KeyError:
+            pass
+
+        if address not in self._state_data:
+            state_entries = self._get_state([address])
+            self._state_data[address] = \
+                state_entries[0].data if state_entries else None
+
+        address_type = addresser.get_address_type(address)
+        entry_class, key_field = CONTAINERS[address_type]
+        container = IndexedContainer(
+            entry_class, key_field, self._state_data[address])
+        self._containers[address] = container
+        return container
+
+    def _get_state(self, addresses):
+        self._metrics.increment('get_state_calls_total')
+        with self._metrics.timer('get_state_seconds'):
+            state_entries = self._context.get_state(
+                addresses=addresses, timeout=self._timeout)
+        self._metrics.increment(
+            'state_bytes_read_total',
+            sum(len(entry.data) for entry in state_entries))
+        return state_entries
+
+    def _set_container(self, address):
+        if address not in self._pending:
+            self._pending.append(address)
+
+
+def _pack_locations(message):
+    """Moves the locations of a record or history chunk into packed,
+    delta-encoded columns, which take far less space than a Location
+    message per entry
+    """
+    if not message.locations:
+        return
+    _unpack_locations(message)
+
+    packed = message.packed_locations
+    latitude = longitude = timestamp = 0
+    for location in message.locations:
+        packed.latitude_deltas.append(location.latitude - latitude)
+        packed.longitude_deltas.append(location.longitude - longitude)
+        packed.timestamp_deltas.append(location.timestamp - timestamp)
+        latitude = location.latitude
+        longitude = location.longitude
+        timestamp = location.timestamp
+    del message.locations[:]
+
+
+def _unpack_locations(message):
+    """Moves any packed locations of a record back into its locations, so
+    they can be appended to and paged out
+    """
+    if not message.HasField('packed_locations'):
+        return
+
+    packed = message.packed_locations
+    locations = []
+    latitude = longitude = timestamp = 0
+    for deltas in zip(packed.latitude_deltas,
+                      packed.longitude_deltas,
+                      packed.timestamp_deltas):
+        latitude += deltas[0]
+        longitude += deltas[1]
+        timestamp += deltas[2]
+        locations.append(record_pb2.Record.Location(
+            latitude=latitude, longitude=longitude, timestamp=timestamp))
+
+    locations.extend(message.locations)
+    del message.locations[:]
+    message.locations.extend(locations)
+    message.ClearField('packed_locations')
@@ -0,0 +1,110 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+from collections import OrderedDict
+import functools
+
+from aiohttp.web import Response
+
+from simple_supply_metrics.metrics import NullMetrics
+
+
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+
+class ResponseCache(object):
+    """Caches the successful responses of GET route handlers, keyed by the
+    handler, the path and query of the request, and the head block they
+    were read at. Once the cached bodies total more than max_size bytes,
+    the least recently used responses are evicted.
+
+    Responses are only cached and served while the head block is known, and
+    are all dropped when it changes, so none is served for an earlier block
+    once the subscriber has notified a new head. Streamed responses are not
+    cached.
+
+    Args:
+        max_size (int): Maximum number of bytes of response bodies cached
+        metrics (Metrics): Counts the hits and misses of each handler
+    """
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, metrics=None):
+        self._max_size = max_size
+        self._metrics = metrics or NullMetrics()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._head = None
+
+    def set_head_block(self, block_id):
+        """Sets the id of the block at the head of the chain, or None if it
+        is unknown, dropping every response cached for an earlier head
+        """
+        if block_id != self._head:
+            self._head = block_id
+            self._entries.clear()
+            self._size = 0
+            self._metrics.set('cache_bytes', 0)
+
+    def cached(self, handler):
+        """Wraps a route handler, serving its responses from the cache
+
+        Args:
+            handler (coroutine function): Takes a request, returning its
+                response
+
+        Returns:
+            coroutine function: The wrapped handler
+        """
+        route = handler.__name__
+
+        @functools.wraps(handler)
+        async def handle(request):
+            head = self._head
+            if head is None:
+                return await handler(request)
+
+            key = (head, route, request.path,
+                   tuple(sorted(request.query.items())))
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._metrics.increment('cache_hits_total', route=route)
+                body, headers = entry
+                return Response(body=body, headers=headers)
+
+            self._metrics.increment('cache_misses_total', route=route)
+            response = await handler(request)
+            # Responses read while the head changed would only be dropped
+            if head == self._head and isinstance(response, Response) \
+                    and response.status == 200:
+                self._store(key, response)
+            return response
+
+        return handle
+
+    def _store(self, key, response):
+        body = response.body
+        if key in self._entries or not isinstance(body, bytes) \
+                or len(body) > self._max_size:
+            return
+
+        headers = {name: value for name, value in response.headers.items()
+                   if name != 'Content-Length'}
+        self._entries[key] = (body, headers)
+        self._size += len(body)
+        while self._size > self._max_size:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self._metrics.increment('cache_evictions_total')
+        self._metrics.set('cache_bytes', self._size)
@@ -15,29 +15,112 @@
 
 import asyncio
 import logging
+import math
 
 import aiopg
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extras import RealDictCursor
 
+from simple_supply_rest_api.errors import ApiBadRequest
+from simple_supply_rest_api.errors import ApiServiceUnavailable
+
 
-LATEST_BLOCK_NUM = """
-SELECT max(block_num) FROM blocks
-"""
 LOGGER = logging.getLogger(__name__)
+# The end_block_num of the history rows which are still open
+MAX_BLOCK_NUMBER = int(math.pow(2, 63)) - 1
+
+# Agents and records at the head of the chain. Each record's owners and
+# locations are aggregated into JSON arrays, in the order they were appended
+# to its history, by subqueries evaluated only for the records returned.
+AGENT_COLUMNS = """
+public_key, name, timestamp
+"""
+
+RECORD_COLUMNS = """
+record_id,
+(
+    SELECT coalesce(json_agg(json_build_object(
+        'latitude', latitude,
+        'longitude', longitude,
+        'timestamp', timestamp) ORDER BY id), '[]')
+    FROM record_locations
+    WHERE record_locations.record_id = records_current.record_id
+    AND end_block_num = {0}
+) AS locations,
+(
+    SELECT coalesce(json_agg(json_build_object(
+        'agent_id', agent_id,
+        'timestamp', timestamp) ORDER BY id), '[]')
+    FROM record_owners
+    WHERE record_owners.record_id = records_current.record_id
+    AND end_block_num = {0}
+) AS owners
+""".format(MAX_BLOCK_NUMBER)
+
+FETCH_AGENTS = """
+SELECT {} FROM agents_current
+""".format(AGENT_COLUMNS)
+
+FETCH_RECORDS = """
+SELECT {} FROM records_current
+""".format(RECORD_COLUMNS)
+
+# The times agents and records can be filtered by, each matching an index
+# the subscriber creates on the time and then the agent's or record's key
+AGENT_CREATED_AT = 'timestamp'
+RECORD_CREATED_AT = 'created_at'
+RECORD_UPDATED_AT = 'greatest(owner_timestamp, location_timestamp)'
+
+DEFAULT_POOL_MIN_SIZE = 1
+DEFAULT_POOL_MAX_SIZE = 10
+DEFAULT_ACQUIRE_TIMEOUT = 10.0
+DEFAULT_POOL_RECYCLE = 600.0
+
+# Number of rows read from the database at a time when streaming a list
+STREAM_BATCH_SIZE = 500
+
+# The subscriber notifies the id of each block it commits on this channel.
+# The head block is also read again after this many seconds without one,
+# which finds any notification missed and checks the connection is alive.
+BLOCKS_CHANNEL = 'simple_supply_blocks'
+HEAD_BLOCK_CHECK_INTERVAL = 30.0
 
 
 class Database(object):
-    """Manages connection to the postgres database and makes async queries
+    """Manages a pool of connections to the postgres database and makes
+    async queries, each on a connection of its own
+
+    Args:
+        host (str): The host of the database
+        port (str): The port of the database
+        name (str): The name of the database
+        user (str): The authorized user of the database
+        password (str): The user's password
+        loop (asyncio.AbstractEventLoop): The event loop of the REST API
+        pool_min_size (int): Number of connections kept open while idle
+        pool_max_size (int): Maximum number of connections open at once
+        acquire_timeout (float): Seconds a query waits for a connection
+            before the request is refused
+        pool_recycle (float): Seconds after which an idle connection is
+            closed and replaced, or -1 to keep connections open
     """
-    def __init__(self, host, port, name, user, password, loop):
+    def __init__(self, host, port, name, user, password, loop,
+                 pool_min_size=DEFAULT_POOL_MIN_SIZE,
+                 pool_max_size=DEFAULT_POOL_MAX_SIZE,
+                 acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT,
+                 pool_recycle=DEFAULT_POOL_RECYCLE):
         self._dsn = 'dbname={} user={} password={} host={} port={}'.format(
             name, user, password, host, port)
         self._loop = loop
-        self._conn = None
+        self._pool = None
+        self._pool_min_size = pool_min_size
+        self._pool_max_size = pool_max_size
+        self._acquire_timeout = acquire_timeout
+        self._pool_recycle = pool_recycle
 
     async def connect(self, retries=5, initial_delay=1, backoff=2):
-        """Initializes a connection to the database
+        """Initializes the pool of connections to the database
 
         Args:
             retries (int): Number of times to retry the connection
@@ -49,8 +132,7 @@ class Database(object):
         delay = initial_delay
         for attempt in range(retries):
             try:
-                self._conn = await aiopg.connect(
-                    dsn=self._dsn, loop=self._loop, echo=True)
+                self._pool = await self._create_pool()
                 LOGGER.info('Successfully connected to database')
                 return
 
@@ -62,14 +144,77 @@ class Database(object):
                 await asyncio.sleep(delay)
                 delay *= backoff
 
-        self._conn = await aiopg.connect(
-            dsn=self._dsn, loop=self._loop, echo=True)
+        self._pool = await self._create_pool()
         LOGGER.info('Successfully connected to database')
 
     def disconnect(self):
-        """Closes connection to the database
+        """Closes every connection to the database
         """
-        self._conn.close()
+        if self._pool is not None:
+            self._pool.close()
+
+    async def watch_head_block(self, callback, retry_delay=1,
+                               max_retry_delay=30):
+        """Calls callback with the id of the head block, and again each time
+        the subscriber commits a new head, until cancelled. The block is
+        tracked on a connection of its own, outside the pool. While that
+        connection is down the head is unknown, and callback is called
+        with None.
+
+        Args:
+            callback (callable): Takes the id of the head block, or None
+            retry_delay (int): Number of seconds to wait before the first
+                reconnect, doubled after each one that fails
+            max_retry_delay (int): Maximum number of seconds to wait
+                between reconnects
+        """
+        delay = retry_delay
+        while True:
+            try:
+                async with aiopg.connect(dsn=self._dsn) as conn:
+                    delay = retry_delay
+                    await self._follow_head_block(conn, callback)
+            # aiopg raises asyncio.TimeoutError when connecting or a query
+            # times out, and OSError when the socket is closed under it
+            except (psycopg2.Error, asyncio.TimeoutError, OSError) as err:
+                callback(None)
+                LOGGER.warning(
+                    'Unable to track the head block, retrying in %ss: %s',
+                    delay, err)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_retry_delay)
+
+    async def _follow_head_block(self, conn, callback):
+        fetch = """
+        SELECT block_id FROM blocks ORDER BY block_num DESC LIMIT 1
+        """
+
+        # Listening before reading the head means no block can be missed
+        async with conn.cursor() as cursor:
+            await cursor.execute('LISTEN {}'.format(BLOCKS_CHANNEL))
+            while True:
+                await cursor.execute(fetch)
+                head = await cursor.fetchone()
+                callback(head[0] if head is not None else None)
+
+                try:
+                    while True:
+                        notify = await asyncio.wait_for(
+                            conn.notifies.get(), HEAD_BLOCK_CHECK_INTERVAL)
+                        callback(notify.payload)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _create_pool(self):
+        return aiopg.create_pool(
+            dsn=self._dsn,
+            minsize=self._pool_min_size,
+            maxsize=self._pool_max_size,
+            pool_recycle=self._pool_recycle)
+
+    def _cursor(self, cursor_factory=None):
+        return _PooledCursor(
+            self._pool, self._acquire_timeout, cursor_factory)
 
     async def create_auth_entry(self,
                                 public_key,
@@ -87,115 +232,326 @@ class Database(object):
             encrypted_private_key.hex(),
             hashed_password.hex())
 
-        async with self._conn.cursor() as cursor:
+        async with self._cursor() as cursor:
             await cursor.execute(insert)
 
-        self._conn.commit()
-
     async def fetch_agent_resource(self, public_key):
         fetch = """
-        SELECT public_key, name, timestamp FROM agents
-        WHERE public_key='{0}'
-        AND ({1}) >= start_block_num
-        AND ({1}) < end_block_num;
-        """.format(public_key, LATEST_BLOCK_NUM)
+        {0} WHERE public_key='{1}';
+        """.format(FETCH_AGENTS, public_key)
 
-        async with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        async with self._cursor(RealDictCursor) as cursor:
             await cursor.execute(fetch)
             return await cursor.fetchone()
 
-    async def fetch_all_agent_resources(self):
-        fetch = """
-        SELECT public_key, name, timestamp FROM agents
-        WHERE ({0}) >= start_block_num
-        AND ({0}) < end_block_num;
-        """.format(LATEST_BLOCK_NUM)
+    async def fetch_all_agent_resources(self, limit=None, start=None,
+                                        created_since=None,
+                                        created_before=None):
+        """Fetches a page of agents, ordered by public key, or by the time
+        they were created and then public key when filtered by it
 
-        async with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            await cursor.execute(fetch)
-            return await cursor.fetchall()
+        Args:
+            limit (int): Maximum number of agents to fetch, or None to fetch
+                every remaining agent
+            start (list): The sort key of the last agent of the previous
+                page, or None to start with the first agent
+            created_since (int): Only fetch agents created at or after this
+                Unix timestamp
+            created_before (int): Only fetch agents created before this Unix
+                timestamp
+
+        Returns:
+            tuple: The agents, and the sort key to start the next page
+                after, or None if there are no more agents
+        """
+        return await self._fetch_page(
+            'agents_current', AGENT_COLUMNS, 'public_key',
+            _agent_filters(created_since, created_before),
+            limit, start)
+
+    async def stream_all_agent_resources(self, write, start=None,
+                                         created_since=None,
+                                         created_before=None):
+        """Reads every agent after start in the order of
+        fetch_all_agent_resources, a batch at a time, without holding more
+        than one batch in memory
+
+        Args:
+            write (coroutine function): Takes each batch of agents, and is
+                awaited before the next batch is read
+            start (list): The sort key of the agent to start after, or None
+                to start with the first agent
+            created_since (int): Only read agents created at or after this
+                Unix timestamp
+            created_before (int): Only read agents created before this Unix
+                timestamp
+        """
+        await self._stream_page(
+            'agents_current', AGENT_COLUMNS, 'public_key',
+            _agent_filters(created_since, created_before),
+            start, write)
 
     async def fetch_auth_resource(self, public_key):
         fetch = """
         SELECT * FROM auth WHERE public_key='{}'
         """.format(public_key)
 
-        async with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        async with self._cursor(RealDictCursor) as cursor:
             await cursor.execute(fetch)
             return await cursor.fetchone()
 
     async def fetch_record_resource(self, record_id):
-        fetch_record = """
-        SELECT record_id FROM records
-        WHERE record_id='{0}'
-        AND ({1}) >= start_block_num
-        AND ({1}) < end_block_num;
-        """.format(record_id, LATEST_BLOCK_NUM)
-
-        fetch_record_locations = """
-        SELECT latitude, longitude, timestamp FROM record_locations
-        WHERE record_id='{0}'
-        AND ({1}) >= start_block_num
-        AND ({1}) < end_block_num;
-        """.format(record_id, LATEST_BLOCK_NUM)
-
-        fetch_record_owners = """
-        SELECT agent_id, timestamp FROM record_owners
-        WHERE record_id='{0}'
-        AND ({1}) >= start_block_num
-        AND ({1}) < end_block_num;
-        """.format(record_id, LATEST_BLOCK_NUM)
-
-        async with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                await cursor.execute(fetch_record)
-                record = await cursor.fetchone()
-
-                await cursor.execute(fetch_record_locations)
-                record['locations'] = await cursor.fetchall()
+        fetch = """
+        {0} WHERE record_id='{1}';
+        """.format(FETCH_RECORDS, record_id)
 
-                await cursor.execute(fetch_record_owners)
-                record['owners'] = await cursor.fetchall()
+        async with self._cursor(RealDictCursor) as cursor:
+            await cursor.execute(fetch)
+            return await cursor.fetchone()
 
-                return record
-            except TypeError:
-                return None
+    async def fetch_all_record_resources(self, limit=None, start=None,
+                                         owner=None,
+                                         created_since=None,
+                                         created_before=None,
+                                         updated_since=None,
+                                         updated_before=None):
+        """Fetches a page of records, ordered by record id, or by the time
+        they were last updated or created and then record id when filtered
+        by either, preferring the time they were last updated
 
-    async def fetch_all_record_resources(self):
-        fetch_records = """
-        SELECT record_id FROM records
-        WHERE ({0}) >= start_block_num
-        AND ({0}) < end_block_num;
-        """.format(LATEST_BLOCK_NUM)
+        Args:
+            limit (int): Maximum number of records to fetch, or None to
+                fetch every remaining record
+            start (list): The sort key of the last record of the previous
+                page, or None to start with the first record
+            owner (str): Only fetch records currently owned by the agent
+                with this public key
+            created_since (int): Only fetch records created at or after
+                this Unix timestamp
+            created_before (int): Only fetch records created before this
+                Unix timestamp
+            updated_since (int): Only fetch records last updated at or after
+                this Unix timestamp
+            updated_before (int): Only fetch records last updated before
+                this Unix timestamp
+
+        Returns:
+            tuple: The records, and the sort key to start the next page
+                after, or None if there are no more records
+        """
+        return await self._fetch_page(
+            'records_current', RECORD_COLUMNS, 'record_id',
+            _record_filters(owner, created_since, created_before,
+                            updated_since, updated_before),
+            limit, start)
+
+    async def stream_all_record_resources(self, write, start=None,
+                                          owner=None,
+                                          created_since=None,
+                                          created_before=None,
+                                          updated_since=None,
+                                          updated_before=None):
+        """Reads every record after start in the order of
+        fetch_all_record_resources, a batch at a time, without holding
+        more than one batch in memory
 
-        async with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                await cursor.execute(fetch_records)
-                records = await cursor.fetchall()
-
-                for record in records:
-                    fetch_record_locations = """
-                    SELECT latitude, longitude, timestamp
-                    FROM record_locations
-                    WHERE record_id='{0}'
-                    AND ({1}) >= start_block_num
-                    AND ({1}) < end_block_num;
-                    """.format(record['record_id'], LATEST_BLOCK_NUM)
-
-                    fetch_record_owners = """
-                    SELECT agent_id, timestamp
-                    FROM record_owners
-                    WHERE record_id='{0}'
-                    AND ({1}) >= start_block_num
-                    AND ({1}) < end_block_num;
-                    """.format(record['record_id'], LATEST_BLOCK_NUM)
-
-                    await cursor.execute(fetch_record_locations)
-                    record['locations'] = await cursor.fetchall()
-
-                    await cursor.execute(fetch_record_owners)
-                    record['owners'] = await cursor.fetchall()
-
-                return records
-            except TypeError:
-                return []
+        Args:
+            write (coroutine function): Takes each batch of records, and is
+                awaited before the next batch is read
+            start (list): The sort key of the record to start after, or
+                None to start with the first record
+            owner (str): Only read records currently owned by the agent
+                with this public key
+            created_since (int): Only read records created at or after this
+                Unix timestamp
+            created_before (int): Only read records created before this
+                Unix timestamp
+            updated_since (int): Only read records last updated at or after
+                this Unix timestamp
+            updated_before (int): Only read records last updated before
+                this Unix timestamp
+        """
+        await self._stream_page(
+            'records_current', RECORD_COLUMNS, 'record_id',
+            _record_filters(owner, created_since, created_before,
+                            updated_since, updated_before),
+            start, write)
+
+    async def _fetch_page(self, table, columns, key, filters, limit, start):
+        fetch, params, sort = _page_query(table, columns, key, filters, start)
+
+        # One more row than requested shows whether there is a next page
+        if limit is not None:
+            fetch += 'LIMIT %s'
+            params.append(limit + 1)
+
+        async with self._cursor(RealDictCursor) as cursor:
+            await cursor.execute(fetch, params)
+            rows = await cursor.fetchall()
+
+        next_start = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_start = [rows[-1]['page_key_' + str(index)]
+                          for index in range(len(sort))]
+
+        _drop_sort_key(rows, sort)
+        return rows, next_start
+
+    async def _stream_page(self, table, columns, key, filters, start, write):
+        fetch, params, sort = _page_query(table, columns, key, filters, start)
+
+        # Pooled connections are in autocommit mode, so the server-side
+        # cursor is declared in a transaction lasting until it is read. If
+        # writing fails part way, the connection is closed with it still
+        # open rather than returned to the pool.
+        async with self._cursor(RealDictCursor) as cursor:
+            await cursor.execute('BEGIN READ ONLY')
+            await cursor.execute(
+                'DECLARE stream_rows NO SCROLL CURSOR FOR ' + fetch, params)
+            while True:
+                await cursor.execute('FETCH {} FROM stream_rows'.format(
+                    STREAM_BATCH_SIZE))
+                rows = await cursor.fetchall()
+                if not rows:
+                    break
+                _drop_sort_key(rows, sort)
+                await write(rows)
+            await cursor.execute('COMMIT')
+
+
+def _agent_filters(created_since, created_before):
+    filters = _Filters()
+    filters.add_time_range(AGENT_CREATED_AT, created_since, created_before)
+    return filters
+
+
+def _record_filters(owner, created_since, created_before,
+                    updated_since, updated_before):
+    filters = _Filters()
+    if owner is not None:
+        filters.add_condition('owner = %s', owner)
+    filters.add_time_range(RECORD_UPDATED_AT, updated_since, updated_before)
+    filters.add_time_range(RECORD_CREATED_AT, created_since, created_before)
+    return filters
+
+
+def _page_query(table, columns, key, filters, start):
+    """Builds the query for the rows of a table after start, returning it
+    with its parameters and the columns the rows are sorted by
+    """
+    # Rows are ordered by the first time filtered by, if any, and then
+    # their key, which are selected again to make the next page's start
+    sort = [key] if filters.sort_time is None else [filters.sort_time, key]
+    conditions = list(filters.conditions)
+    params = list(filters.params)
+
+    if start is not None:
+        if not _is_sort_key(start, sort):
+            raise ApiBadRequest(
+                'Paging start does not match the filters of the request')
+        conditions.append('({}) > ({})'.format(
+            ', '.join(sort), ', '.join(['%s'] * len(sort))))
+        params.extend(start)
+
+    fetch = """
+    SELECT {0}, {1} FROM {2}
+    {3}
+    ORDER BY {4}
+    """.format(
+        columns,
+        ', '.join('{} AS page_key_{}'.format(column, index)
+                  for index, column in enumerate(sort)),
+        table,
+        'WHERE ' + ' AND '.join(conditions) if conditions else '',
+        ', '.join(sort))
+    return fetch, params, sort
+
+
+def _drop_sort_key(rows, sort):
+    for row in rows:
+        for index in range(len(sort)):
+            del row['page_key_' + str(index)]
+
+
+class _Filters(object):
+    """Collects the conditions a page of agents or records is filtered by,
+    and the first time column filtered by, which the page is sorted by
+    """
+    def __init__(self):
+        self.conditions = []
+        self.params = []
+        self.sort_time = None
+
+    def add_condition(self, condition, param):
+        self.conditions.append(condition)
+        self.params.append(param)
+
+    def add_time_range(self, column, since, before):
+        if since is not None:
+            self.add_condition('{} >= %s'.format(column), since)
+        if before is not None:
+            self.add_condition('{} < %s'.format(column), before)
+        if self.sort_time is None and (
+                since is not None or before is not None):
+            self.sort_time = column
+
+
+def _is_sort_key(start, sort):
+    # Sort keys are a time and then a key, or just a key
+    return (
+        isinstance(start, list)
+        and len(start) == len(sort)
+        and isinstance(start[-1], str)
+        and all(isinstance(time, int) and not isinstance(time, bool)
+                for time in start[:-1]))
+
+
+class _PooledCursor(object):
+    """Acquires a connection from a pool for the duration of an async with
+    block, and opens a cursor on it. Connections which fail with an
+    OperationalError, such as those dropped by the server, or which are
+    left in a transaction or mid-query, are closed rather than returned to
+    the pool, so later queries get a healthy one.
+    """
+    def __init__(self, pool, acquire_timeout, cursor_factory):
+        self._pool = pool
+        self._acquire_timeout = acquire_timeout
+        self._cursor_factory = cursor_factory
+        self._conn = None
+        self._cursor = None
+
+    async def __aenter__(self):
+        try:
+            self._conn = await asyncio.wait_for(
+                self._pool.acquire(), self._acquire_timeout)
+        except asyncio.TimeoutError:
+            raise ApiServiceUnavailable(
+                'No database connection available, try again later')
+
+        try:
+            self._cursor = await self._conn.cursor(
+                cursor_factory=self._cursor_factory)
+        except Exception:
+            self._release(broken=True)
+            raise
+        return self._cursor
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self._cursor.close()
+        self._release(
+            broken=exc_type is not None and (
+                issubclass(exc_type, psycopg2.OperationalError)
+                or not self._is_idle()))
+
+    def _is_idle(self):
+        return (
+            not self._conn.closed
+            and self._conn.raw.get_transaction_status()
+            == TRANSACTION_STATUS_IDLE)
+
+    def _release(self, broken):
+        if broken:
+            LOGGER.warning('Closing broken database connection')
+            self._conn.close()
+        self._pool.release(self._conn)
@@ -74,3 +74,10 @@ class ApiUnauthorized(_ApiError):
         self.status_code = 401
         self.message = 'Unauthorized: ' + message
         super().__init__()
+
+
+class ApiServiceUnavailable(_ApiError):
+    def __init__(self, message):
+        self.status_code = 503
+        self.message = 'Service Unavailable: ' + message
+        super().__init__()
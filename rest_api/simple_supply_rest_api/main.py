@@ -24,12 +24,20 @@ from sawtooth_sdk.processor.log import init_console_logging
 
 from aiohttp import web
 
+from simple_supply_metrics.metrics import start_metrics
+from simple_supply_rest_api.cache import DEFAULT_CACHE_SIZE
+from simple_supply_rest_api.cache import ResponseCache
 from simple_supply_rest_api.route_handler import RouteHandler
 from simple_supply_rest_api.database import Database
+from simple_supply_rest_api.database import DEFAULT_ACQUIRE_TIMEOUT
+from simple_supply_rest_api.database import DEFAULT_POOL_MAX_SIZE
+from simple_supply_rest_api.database import DEFAULT_POOL_MIN_SIZE
+from simple_supply_rest_api.database import DEFAULT_POOL_RECYCLE
 from simple_supply_rest_api.messaging import Messenger
 
 
 LOGGER = logging.getLogger(__name__)
+METRICS_PREFIX = 'simple_supply_rest_api_'
 
 
 def parse_args(args):
@@ -68,18 +76,64 @@ def parse_args(args):
         '--db-password',
         help="The authorized user's password for database access",
         default='sawtooth')
+    parser.add_argument(
+        '--db-pool-min-size',
+        help='The number of database connections kept open while idle',
+        type=int,
+        default=DEFAULT_POOL_MIN_SIZE)
+    parser.add_argument(
+        '--db-pool-max-size',
+        help='The maximum number of database connections open at once',
+        type=int,
+        default=DEFAULT_POOL_MAX_SIZE)
+    parser.add_argument(
+        '--db-acquire-timeout',
+        help='The number of seconds a request waits for a database '
+             'connection before it is refused',
+        type=float,
+        default=DEFAULT_ACQUIRE_TIMEOUT)
+    parser.add_argument(
+        '--db-pool-recycle',
+        help='The number of seconds after which an idle database '
+             'connection is replaced, or -1 to keep connections open',
+        type=float,
+        default=DEFAULT_POOL_RECYCLE)
+    parser.add_argument(
+        '--cache-size',
+        help='The size in MB of the cache of responses read at the head '
+             'block, or 0 to disable it',
+        type=float,
+        default=DEFAULT_CACHE_SIZE / (1024 * 1024))
+    parser.add_argument(
+        '--metrics-bind',
+        help='Serve REST API metrics over HTTP at host:port/metrics')
+    parser.add_argument(
+        '--metrics-interval',
+        help='Log a summary of REST API metrics every N seconds',
+        type=float,
+        default=0)
     parser.add_argument(
         '-v', '--verbose',
         action='count',
         default=0,
         help='enable more verbose output to stderr')
 
-    return parser.parse_args(args)
+    opts = parser.parse_args(args)
+    if not 0 <= opts.db_pool_min_size <= opts.db_pool_max_size:
+        parser.error(
+            '--db-pool-min-size must be between 0 and --db-pool-max-size')
+    if opts.cache_size < 0:
+        parser.error('--cache-size must not be negative')
+
+    return opts
 
 
-def start_rest_api(host, port, messenger, database):
+def start_rest_api(host, port, messenger, database, cache=None):
     loop = asyncio.get_event_loop()
     asyncio.ensure_future(database.connect())
+    if cache is not None:
+        asyncio.ensure_future(
+            database.watch_head_block(cache.set_head_block))
 
     app = web.Application(loop=loop)
     # WARNING: UNSAFE KEY STORAGE
@@ -90,16 +144,18 @@ def start_rest_api(host, port, messenger, database):
     messenger.open_validator_connection()
 
     handler = RouteHandler(loop, messenger, database)
+    # Reads only change when a block is committed, so are cached per block
+    cached = cache.cached if cache is not None else lambda read: read
 
     app.router.add_post('/authentication', handler.authenticate)
 
     app.router.add_post('/agents', handler.create_agent)
-    app.router.add_get('/agents', handler.list_agents)
-    app.router.add_get('/agents/{agent_id}', handler.fetch_agent)
+    app.router.add_get('/agents', cached(handler.list_agents))
+    app.router.add_get('/agents/{agent_id}', cached(handler.fetch_agent))
 
     app.router.add_post('/records', handler.create_record)
-    app.router.add_get('/records', handler.list_records)
-    app.router.add_get('/records/{record_id}', handler.fetch_record)
+    app.router.add_get('/records', cached(handler.list_records))
+    app.router.add_get('/records/{record_id}', cached(handler.fetch_record))
     app.router.add_post(
         '/records/{record_id}/transfer', handler.transfer_record)
     app.router.add_post('/records/{record_id}/update', handler.update_record)
@@ -133,7 +189,18 @@ def main():
             opts.db_name,
             opts.db_user,
             opts.db_password,
-            loop)
+            loop,
+            pool_min_size=opts.db_pool_min_size,
+            pool_max_size=opts.db_pool_max_size,
+            acquire_timeout=opts.db_acquire_timeout,
+            pool_recycle=opts.db_pool_recycle)
+
+        metrics = start_metrics(opts, METRICS_PREFIX)
+        cache = None
+        if opts.cache_size > 0:
+            cache = ResponseCache(
+                max_size=int(opts.cache_size * 1024 * 1024),
+                metrics=metrics)
 
         try:
             host, port = opts.bind.split(":")
@@ -143,7 +210,7 @@ def main():
                   " host:port".format(opts.bind))
             sys.exit(1)
 
-        start_rest_api(host, port, messenger, database)
+        start_rest_api(host, port, messenger, database, cache)
     except Exception as err:  # pylint: disable=broad-except
         LOGGER.exception(err)
         sys.exit(1)
@@ -12,12 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ------------------------------------------------------------------------------
+import base64
 import datetime
+import json
 from json.decoder import JSONDecodeError
 import logging
 import time
 
 from aiohttp.web import json_response
+from aiohttp.web import StreamResponse
 import bcrypt
 from Crypto.Cipher import AES
 from itsdangerous import BadSignature
@@ -29,6 +32,8 @@ from simple_supply_rest_api.errors import ApiUnauthorized
 
 
 LOGGER = logging.getLogger(__name__)
+MAX_PAGE_LIMIT = 1000
+NEXT_START_HEADER = 'X-Next-Start'
 
 
 class RouteHandler(object):
@@ -82,9 +87,24 @@ class RouteHandler(object):
 
         return json_response({'authorization': token})
 
-    async def list_agents(self, _request):
-        agent_list = await self._database.fetch_all_agent_resources()
-        return json_response(agent_list)
+    async def list_agents(self, request):
+        limit, start = parse_paging(request)
+        filters = {
+            'start': start,
+            'created_since': parse_timestamp(request, 'created_since'),
+            'created_before': parse_timestamp(request, 'created_before'),
+        }
+
+        # Without a limit every agent is listed, which is streamed to the
+        # client as it is read rather than held in memory
+        if limit is None:
+            return await stream_response(
+                request, self._database.stream_all_agent_resources, filters)
+
+        agent_list, next_start = \
+            await self._database.fetch_all_agent_resources(
+                limit=limit, **filters)
+        return paged_response(agent_list, next_start)
 
     async def fetch_agent(self, request):
         public_key = request.match_info.get('agent_id', '')
@@ -111,9 +131,25 @@ class RouteHandler(object):
         return json_response(
             {'data': 'Create record transaction submitted'})
 
-    async def list_records(self, _request):
-        record_list = await self._database.fetch_all_record_resources()
-        return json_response(record_list)
+    async def list_records(self, request):
+        limit, start = parse_paging(request)
+        filters = {
+            'start': start,
+            'owner': request.query.get('owner'),
+            'created_since': parse_timestamp(request, 'created_since'),
+            'created_before': parse_timestamp(request, 'created_before'),
+            'updated_since': parse_timestamp(request, 'updated_since'),
+            'updated_before': parse_timestamp(request, 'updated_before'),
+        }
+
+        if limit is None:
+            return await stream_response(
+                request, self._database.stream_all_record_resources, filters)
+
+        record_list, next_start = \
+            await self._database.fetch_all_record_resources(
+                limit=limit, **filters)
+        return paged_response(record_list, next_start)
 
     async def fetch_record(self, request):
         record_id = request.match_info.get('record_id', '')
@@ -198,6 +234,80 @@ def validate_fields(required_fields, body):
                 "'{}' parameter is required".format(field))
 
 
+def parse_paging(request):
+    """Parses the limit and start query parameters of a list request. The
+    start is an opaque cursor returned in the NEXT_START_HEADER of the
+    previous page.
+    """
+    limit = request.query.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ApiBadRequest("'limit' must be an integer")
+        if not 1 <= limit <= MAX_PAGE_LIMIT:
+            raise ApiBadRequest(
+                "'limit' must be between 1 and {}".format(MAX_PAGE_LIMIT))
+
+    start = request.query.get('start')
+    if start is not None:
+        try:
+            start = json.loads(base64.urlsafe_b64decode(start).decode())
+        except ValueError:
+            raise ApiBadRequest("'start' is not a valid paging cursor")
+
+    return limit, start
+
+
+def parse_timestamp(request, name):
+    value = request.query.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiBadRequest(
+            "'{}' must be a Unix timestamp in seconds".format(name))
+
+
+def paged_response(resources, next_start):
+    """Responds with a page of resources, and the cursor to request the
+    next page with, if there is one
+    """
+    headers = {}
+    if next_start is not None:
+        headers[NEXT_START_HEADER] = base64.urlsafe_b64encode(
+            json.dumps(next_start).encode()).decode()
+    return json_response(resources, headers=headers)
+
+
+async def stream_response(request, stream, filters):
+    """Responds with a JSON array of resources, sending each batch read by
+    stream as a chunk as soon as it is read. The status and headers are
+    sent with the first batch, so errors raised before it, such as an
+    invalid start, are still returned as errors. If reading fails after
+    that, the response is cut short, leaving the array unterminated.
+    """
+    response = StreamResponse(headers={'Content-Type': 'application/json'})
+    response.enable_chunked_encoding()
+
+    async def write(resources):
+        separator = b',' if response.prepared else b'['
+        if not response.prepared:
+            await response.prepare(request)
+        await response.write(separator + b','.join(
+            json.dumps(resource).encode() for resource in resources))
+
+    await stream(write, **filters)
+    if response.prepared:
+        await response.write(b']')
+    else:
+        await response.prepare(request)
+        await response.write(b'[]')
+    await response.write_eof()
+    return response
+
+
 def encrypt_private_key(aes_key, public_key, private_key):
     init_vector = bytes.fromhex(public_key[:32])
     cipher = AES.new(bytes.fromhex(aes_key), AES.MODE_CBC, init_vector)
@@ -83,13 +83,13 @@ def make_create_record_transaction(transaction_signer,
         batch_pb2.Batch: The transaction wrapped in a batch
     """
 
-    inputs = [
-        addresser.get_agent_address(
-            transaction_signer.get_public_key().as_hex()),
-        addresser.get_record_address(record_id)
-    ]
+    agent_address = addresser.get_agent_address(
+        transaction_signer.get_public_key().as_hex())
+    record_address = addresser.get_record_address(record_id)
 
-    outputs = [addresser.get_record_address(record_id)]
+    inputs = [agent_address, record_address]
+
+    outputs = [record_address]
 
     action = payload_pb2.CreateRecordAction(
         record_id=record_id,
@@ -131,10 +131,16 @@ def make_transfer_record_transaction(transaction_signer,
         transaction_signer.get_public_key().as_hex())
     receiving_agent_address = addresser.get_agent_address(receiving_agent)
     record_address = addresser.get_record_address(record_id)
+    history_prefix = addresser.get_record_history_prefix(record_id)
 
-    inputs = [sending_agent_address, receiving_agent_address, record_address]
+    inputs = [
+        sending_agent_address,
+        receiving_agent_address,
+        record_address,
+        history_prefix
+    ]
 
-    outputs = [record_address]
+    outputs = [record_address, history_prefix]
 
     action = payload_pb2.TransferRecordAction(
         record_id=record_id,
@@ -176,10 +182,11 @@ def make_update_record_transaction(transaction_signer,
     agent_address = addresser.get_agent_address(
         transaction_signer.get_public_key().as_hex())
     record_address = addresser.get_record_address(record_id)
+    history_prefix = addresser.get_record_history_prefix(record_id)
 
-    inputs = [agent_address, record_address]
+    inputs = [agent_address, record_address, history_prefix]
 
-    outputs = [record_address]
+    outputs = [record_address, history_prefix]
 
     action = payload_pb2.UpdateRecordAction(
         record_id=record_id,
@@ -200,6 +207,73 @@ def make_update_record_transaction(transaction_signer,
         batch_signer=batch_signer)
 
 
+def make_batch_update_transaction(transaction_signer,
+                                  batch_signer,
+                                  updates,
+                                  transfers,
+                                  timestamp):
+    """Make a BatchUpdateAction transaction and wrap it in a batch
+
+    Args:
+        transaction_signer (sawtooth_signing.Signer): The transaction key pair
+        batch_signer (sawtooth_signing.Signer): The batch key pair
+        updates (list of dict): Location updates, each with a record_id,
+            latitude and longitude
+        transfers (list of dict): Ownership transfers, each with a record_id
+            and the public key of the receiving_agent
+        timestamp (int): Unix UTC timestamp of when the records are updated
+
+    Returns:
+        batch_pb2.Batch: The transaction wrapped in a batch
+    """
+    agent_address = addresser.get_agent_address(
+        transaction_signer.get_public_key().as_hex())
+
+    record_ids = _unique(
+        [action['record_id'] for action in updates + transfers])
+    record_addresses = addresser.get_record_addresses(record_ids) + [
+        addresser.get_record_history_prefix(record_id)
+        for record_id in record_ids
+    ]
+    receiving_agent_addresses = addresser.get_agent_addresses(
+        [action['receiving_agent'] for action in transfers])
+
+    inputs = [agent_address] + record_addresses + receiving_agent_addresses
+    outputs = record_addresses
+
+    action = payload_pb2.BatchUpdateAction(
+        updates=[
+            payload_pb2.UpdateRecordAction(
+                record_id=update['record_id'],
+                latitude=update['latitude'],
+                longitude=update['longitude'])
+            for update in updates
+        ],
+        transfers=[
+            payload_pb2.TransferRecordAction(
+                record_id=transfer['record_id'],
+                receiving_agent=transfer['receiving_agent'])
+            for transfer in transfers
+        ])
+
+    payload = payload_pb2.SimpleSupplyPayload(
+        action=payload_pb2.SimpleSupplyPayload.BATCH_UPDATE,
+        batch_update=action,
+        timestamp=timestamp)
+    payload_bytes = payload.SerializeToString()
+
+    return _make_batch(
+        payload_bytes=payload_bytes,
+        inputs=_unique(inputs),
+        outputs=_unique(outputs),
+        transaction_signer=transaction_signer,
+        batch_signer=batch_signer)
+
+
+def _unique(items):
+    return list(dict.fromkeys(items))
+
+
 def _make_batch(payload_bytes,
                 inputs,
                 outputs,
@@ -0,0 +1,227 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import logging
+import os
+import struct
+import time
+
+from sawtooth_sdk.protobuf.events_pb2 import EventList
+
+
+LOGGER = logging.getLogger(__name__)
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Each segment is a series of entries, a header holding the time the event
+# list was received and its length, followed by the serialized EventList
+ENTRY_HEADER = struct.Struct('!dI')
+SEGMENT_NAME = 'events-{:08d}.seg'
+
+# The block index has an entry for each captured block-commit event, giving
+# the block number and the segment and offset of the event list holding it
+INDEX_ENTRY = struct.Struct('!QIQ')
+INDEX_NAME = 'blocks.idx'
+
+
+class CaptureWriter(object):
+    """Appends the serialized event lists received by a Subscriber to a
+    directory of segment files, starting a new segment once the current one
+    reaches segment_size bytes, and indexes the blocks they commit. Writing
+    to an existing capture appends to it.
+
+    Every entry is flushed as it is written, and readers ignore an entry
+    left incomplete by a crash, so a capture can be read while it is being
+    written. An incomplete entry is truncated before appending to an
+    existing capture.
+
+    Args:
+        directory (str): The directory holding the capture
+        segment_size (int): Size in bytes after which a new segment is
+            started
+    """
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._segment_size = segment_size
+
+        segments = _list_segments(directory)
+        self._segment = segments[-1] if segments else 0
+        index_path = os.path.join(directory, INDEX_NAME)
+        if segments:
+            _truncate_incomplete(self._segment_path())
+        if os.path.isfile(index_path):
+            size = os.path.getsize(index_path)
+            os.truncate(index_path, size - size % INDEX_ENTRY.size)
+
+        self._file = open(self._segment_path(), 'ab')
+        self._index = open(index_path, 'ab')
+
+    def write(self, content, events):
+        """Appends an event list to the capture
+
+        Args:
+            content (bytes): The serialized EventList, as received
+            events (list of Event): The parsed events of the list
+        """
+        if self._file.tell() >= self._segment_size:
+            self._file.close()
+            self._segment += 1
+            self._file = open(self._segment_path(), 'ab')
+
+        offset = self._file.tell()
+        self._file.write(ENTRY_HEADER.pack(time.time(), len(content)))
+        self._file.write(content)
+        self._file.flush()
+
+        block_num = parse_block_num(events)
+        if block_num is not None:
+            self._index.write(
+                INDEX_ENTRY.pack(block_num, self._segment, offset))
+            self._index.flush()
+
+    def close(self):
+        self._file.close()
+        self._index.close()
+
+    def _segment_path(self):
+        return os.path.join(
+            self._directory, SEGMENT_NAME.format(self._segment))
+
+
+class CaptureReader(object):  # pylint: disable=too-few-public-methods
+    """Reads the event lists of a capture written by a CaptureWriter, in the
+    order they were received
+
+    Args:
+        directory (str): The directory holding the capture
+    """
+    def __init__(self, directory):
+        if not os.path.isfile(os.path.join(directory, INDEX_NAME)):
+            raise FileNotFoundError(
+                'No event capture found in {}'.format(directory))
+        self._directory = directory
+
+    def entries(self, from_block=None):
+        """Yields the captured event lists
+
+        Args:
+            from_block (int): Start at the first event list committing this
+                block or a later one, rather than at the start of the capture
+
+        Yields:
+            tuple: The time the event list was received, and its bytes
+        """
+        segment, offset = 0, 0
+        if from_block is not None:
+            position = self._find_block(from_block)
+            if position is None:
+                return
+            segment, offset = position
+
+        for number in _list_segments(self._directory):
+            if number < segment:
+                continue
+            path = os.path.join(self._directory, SEGMENT_NAME.format(number))
+            with open(path, 'rb') as segment_file:
+                if number == segment:
+                    segment_file.seek(offset)
+                yield from _read_segment(segment_file)
+
+    def _find_block(self, block_num):
+        with open(os.path.join(self._directory, INDEX_NAME), 'rb') as index:
+            data = index.read()
+
+        end = len(data) - len(data) % INDEX_ENTRY.size
+        for entry_num, segment, offset in INDEX_ENTRY.iter_unpack(data[:end]):
+            if entry_num >= block_num:
+                return segment, offset
+        return None
+
+
+def replay(reader, handler, from_block=None, speed=0):
+    """Passes the events of a capture to a handler, as Subscriber.start
+    does with the events it receives
+
+    Args:
+        reader (CaptureReader): The capture to replay
+        handler (callable): Takes the list of events of each event list
+        from_block (int): The first block to replay
+        speed (float): Replay at this multiple of the pace the events were
+            received at, or as fast as the handler allows if 0
+
+    Returns:
+        int: The number of event lists replayed
+    """
+    count = 0
+    first_received = None
+    start = time.monotonic()
+
+    for received_at, content in reader.entries(from_block):
+        if speed > 0:
+            if first_received is None:
+                first_received = received_at
+            delay = (received_at - first_received) / speed - (
+                time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        event_list = EventList()
+        event_list.ParseFromString(content)
+        handler(event_list.events)
+        count += 1
+
+    LOGGER.info('Replayed %s event lists', count)
+    return count
+
+
+def _read_segment(segment_file):
+    while True:
+        header = segment_file.read(ENTRY_HEADER.size)
+        if len(header) < ENTRY_HEADER.size:
+            return
+        received_at, length = ENTRY_HEADER.unpack(header)
+        content = segment_file.read(length)
+        if len(content) < length:
+            return
+        yield received_at, content
+
+
+def _truncate_incomplete(path):
+    end = 0
+    with open(path, 'rb') as segment_file:
+        for _, content in _read_segment(segment_file):
+            end += ENTRY_HEADER.size + len(content)
+    if end < os.path.getsize(path):
+        LOGGER.warning('Truncating incomplete entry at the end of %s', path)
+        os.truncate(path, end)
+
+
+def _list_segments(directory):
+    return sorted(
+        int(name[len('events-'):-len('.seg')])
+        for name in os.listdir(directory)
+        if name.startswith('events-') and name.endswith('.seg'))
+
+
+def parse_block_num(events):
+    """Returns the number of the block committed in a list of events, or
+    None if it holds no block-commit event
+    """
+    for event in events:
+        if event.event_type == 'sawtooth/block-commit':
+            for attribute in event.attributes:
+                if attribute.key == 'block_num':
+                    return int(attribute.value)
+    return None
@@ -18,81 +18,85 @@ import time
 
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.extras import execute_values
 
-
-LOGGER = logging.getLogger(__name__)
-
-
-CREATE_BLOCK_STMTS = """
-CREATE TABLE IF NOT EXISTS blocks (
-    block_num  bigint PRIMARY KEY,
-    block_id   varchar
-);
-"""
-
-
-CREATE_AUTH_STMTS = """
-CREATE TABLE IF NOT EXISTS auth (
-    public_key            varchar PRIMARY KEY,
-    hashed_password       varchar,
-    encrypted_private_key varchar
-)
-"""
-
-
-CREATE_RECORD_STMTS = """
-CREATE TABLE IF NOT EXISTS records (
-    id               bigserial PRIMARY KEY,
-    record_id        varchar,
-    start_block_num  bigint,
-    end_block_num    bigint
-);
-"""
-
-
-CREATE_RECORD_LOCATION_STMTS = """
-CREATE TABLE IF NOT EXISTS record_locations (
-    id               bigserial PRIMARY KEY,
-    record_id        varchar,
-    latitude         bigint,
-    longitude        bigint,
-    timestamp        bigint,
-    start_block_num  bigint,
-    end_block_num    bigint
-);
-"""
+from simple_supply_metrics.metrics import NullMetrics
+from simple_supply_subscriber.migrations import apply_migrations
+from simple_supply_subscriber.migrations import INSERT_CURRENT_AGENTS_STMTS
+from simple_supply_subscriber.migrations import MAX_BLOCK_NUMBER
+from simple_supply_subscriber.migrations import UPDATE_CURRENT_RECORDS_STMTS
+from simple_supply_subscriber.migrations import VERSIONED_TABLES
 
 
-CREATE_RECORD_OWNER_STMTS = """
-CREATE TABLE IF NOT EXISTS record_owners (
-    id               bigserial PRIMARY KEY,
-    record_id        varchar,
-    agent_id         varchar,
-    timestamp        bigint,
-    start_block_num  bigint,
-    end_block_num    bigint
-);
-"""
-
-
-CREATE_AGENT_STMTS = """
-CREATE TABLE IF NOT EXISTS agents (
-    id               bigserial PRIMARY KEY,
-    public_key       varchar,
-    name             varchar,
-    timestamp        bigint,
-    start_block_num  bigint,
-    end_block_num    bigint
-);
+LOGGER = logging.getLogger(__name__)
+DEFAULT_BATCH_SIZE = 1000
+# Each block inserted is notified on this channel when it is committed, with
+# its id as the payload, so readers can tell when the head block changes
+BLOCKS_CHANNEL = 'simple_supply_blocks'
+
+
+INSERT_HISTORY_STMTS = {
+    'record_locations': """
+    INSERT INTO record_locations (
+    record_id,
+    latitude,
+    longitude,
+    timestamp,
+    start_block_num,
+    end_block_num)
+    VALUES %s
+    """,
+    'record_owners': """
+    INSERT INTO record_owners (
+    record_id,
+    agent_id,
+    timestamp,
+    start_block_num,
+    end_block_num)
+    VALUES %s
+    """,
+}
+
+# The columns of records_current counting the rows of each history table
+HISTORY_COUNT_COLUMNS = [
+    ('record_owners', 'owner_count'),
+    ('record_locations', 'location_count'),
+]
+
+# Adjusts the history counts of records by the open rows a fork deletes and
+# the closed rows it reopens, both found through the fork indexes. {0} is
+# the history table, {1} its count column, {2} the first block of the fork
+# and {3} MAX_BLOCK_NUMBER.
+ADJUST_HISTORY_COUNTS_STMTS = """
+UPDATE records_current SET {1} = {1} + changed.delta
+FROM (
+    SELECT record_id,
+    sum(CASE WHEN start_block_num >= {2} THEN -1 ELSE 1 END) AS delta
+    FROM {0}
+    WHERE (start_block_num >= {2} AND end_block_num = {3})
+    OR (start_block_num < {2} AND end_block_num >= {2}
+        AND end_block_num < {3})
+    GROUP BY record_id
+) AS changed
+WHERE records_current.record_id = changed.record_id
 """
 
 
 class Database(object):
     """Simple object for managing a connection to a postgres database
+
+    Args:
+        dsn (str): The connection string for the database
+        batch_size (int): Maximum number of rows sent per INSERT statement
+            when indexing a record's history
+        metrics (Metrics): Records the time spent writing and the number
+            of rows written
     """
-    def __init__(self, dsn):
+    def __init__(self, dsn, batch_size=DEFAULT_BATCH_SIZE, metrics=None):
         self._dsn = dsn
         self._conn = None
+        self._batch_size = batch_size
+        self._metrics = metrics or NullMetrics()
 
     def connect(self, retries=5, initial_delay=1, backoff=2):
         """Initializes a connection to the database
@@ -122,29 +126,11 @@ class Database(object):
         self._conn = psycopg2.connect(self._dsn)
         LOGGER.info('Successfully connected to database')
 
-    def create_tables(self):
-        """Creates the Simple Supply tables
+    def migrate(self):
+        """Creates the Simple Supply tables, or upgrades them to the latest
+        schema version
         """
-        with self._conn.cursor() as cursor:
-            LOGGER.debug('Creating table: blocks')
-            cursor.execute(CREATE_BLOCK_STMTS)
-
-            LOGGER.debug('Creating table: auth')
-            cursor.execute(CREATE_AUTH_STMTS)
-
-            LOGGER.debug('Creating table: records')
-            cursor.execute(CREATE_RECORD_STMTS)
-
-            LOGGER.debug('Creating table: record_locations')
-            cursor.execute(CREATE_RECORD_LOCATION_STMTS)
-
-            LOGGER.debug('Creating table: record_owners')
-            cursor.execute(CREATE_RECORD_OWNER_STMTS)
-
-            LOGGER.debug('Creating table: agents')
-            cursor.execute(CREATE_AGENT_STMTS)
-
-        self._conn.commit()
+        apply_migrations(self._conn)
 
     def disconnect(self):
         """Closes the connection to the database
@@ -154,49 +140,44 @@ class Database(object):
             self._conn.close()
 
     def commit(self):
-        self._conn.commit()
+        with self._metrics.timer('db_seconds', operation='commit'):
+            self._conn.commit()
 
     def rollback(self):
         self._conn.rollback()
 
     def drop_fork(self, block_num):
-        """Deletes all resources from a particular block_num
+        """Deletes all resources from a particular block_num, and reopens
+        the resources which were closed by those blocks. The current rows
+        of the agents and records changed by those blocks are then rebuilt
+        from the versions which are open again.
         """
-        delete_agents = """
-        DELETE FROM agents WHERE start_block_num >= {}
-        """.format(block_num)
-        update_agents = """
-        UPDATE agents SET end_block_num = null
-        WHERE end_block_num >= {}
-        """.format(block_num)
-
-        delete_record_locations = """
-        DELETE FROM record_owners WHERE record_id =
-        (SELECT record_id FROM records WHERE start_block_num >= {})
-        """.format(block_num)
-        delete_record_owners = """
-        DELETE FROM record_owners WHERE record_id =
-        (SELECT record_id FROM records WHERE start_block_num >= {})
-        """.format(block_num)
-        delete_records = """
-        DELETE FROM records WHERE start_block_num >= {}
-        """.format(block_num)
-        update_records = """
-        UPDATE records SET end_block_num = null
-        WHERE end_block_num >= {}
-        """.format(block_num)
-
         delete_blocks = """
         DELETE FROM blocks WHERE block_num >= {}
         """.format(block_num)
 
-        with self._conn.cursor() as cursor:
-            cursor.execute(delete_agents)
-            cursor.execute(update_agents)
-            cursor.execute(delete_record_locations)
-            cursor.execute(delete_record_owners)
-            cursor.execute(delete_records)
-            cursor.execute(update_records)
+        with self._metrics.timer('db_seconds', operation='drop_fork'), \
+                self._conn.cursor() as cursor:
+            # The history counts of the records are adjusted by the rows
+            # about to be dropped and reopened, rather than counted again
+            for table, column in HISTORY_COUNT_COLUMNS:
+                cursor.execute(ADJUST_HISTORY_COUNTS_STMTS.format(
+                    table, column, block_num, MAX_BLOCK_NUMBER))
+
+            for table in VERSIONED_TABLES:
+                cursor.execute("""
+                DELETE FROM {} WHERE start_block_num >= {}
+                """.format(table, block_num))
+                cursor.execute("""
+                UPDATE {0} SET end_block_num = {1}
+                WHERE end_block_num >= {2} AND end_block_num < {1}
+                """.format(table, MAX_BLOCK_NUMBER, block_num))
+
+            _rebuild_current_rows(
+                cursor, block_num, 'agents_current', 'public_key',
+                [INSERT_CURRENT_AGENTS_STMTS])
+            _rebuild_current_records(cursor, block_num)
+
             cursor.execute(delete_blocks)
 
     def fetch_last_known_blocks(self, count):
@@ -234,17 +215,30 @@ class Database(object):
             block_dict['block_num'],
             block_dict['block_id'])
 
+        notify = """
+        NOTIFY {}, '{}'
+        """.format(
+            BLOCKS_CHANNEL,
+            block_dict['block_id'])
+
         with self._conn.cursor() as cursor:
             cursor.execute(insert)
+            cursor.execute(notify)
+
+    def insert_agent(self, agent, block_num):
+        """Closes the current version of an agent and inserts a new one
 
-    def insert_agent(self, agent_dict):
+        Args:
+            agent (Agent): The agent's row, as decoded from state
+            block_num (int): The block the agent was changed in
+        """
         update_agent = """
         UPDATE agents SET end_block_num = {}
         WHERE end_block_num = {} AND public_key = '{}'
         """.format(
-            agent_dict['start_block_num'],
-            agent_dict['end_block_num'],
-            agent_dict['public_key'])
+            block_num,
+            MAX_BLOCK_NUMBER,
+            agent.public_key)
 
         insert_agent = """
         INSERT INTO agents (
@@ -255,24 +249,48 @@ class Database(object):
         end_block_num)
         VALUES ('{}', '{}', '{}', '{}', '{}');
         """.format(
-            agent_dict['public_key'],
-            agent_dict['name'],
-            agent_dict['timestamp'],
-            agent_dict['start_block_num'],
-            agent_dict['end_block_num'])
+            agent.public_key,
+            agent.name,
+            agent.timestamp,
+            block_num,
+            MAX_BLOCK_NUMBER)
+
+        upsert_current_agent = """
+        INSERT INTO agents_current (
+        public_key,
+        name,
+        timestamp,
+        block_num)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (public_key) DO UPDATE SET
+        name = excluded.name,
+        timestamp = excluded.timestamp,
+        block_num = excluded.block_num
+        """
 
-        with self._conn.cursor() as cursor:
+        with self._metrics.timer('db_seconds', operation='insert_agent'), \
+                self._conn.cursor() as cursor:
             cursor.execute(update_agent)
             cursor.execute(insert_agent)
+            cursor.execute(upsert_current_agent, agent + (block_num,))
+        self._metrics.increment('rows_written_total', table='agents')
+        self._metrics.increment('rows_written_total', table='agents_current')
+
+    def insert_record(self, record, block_num):
+        """Closes the current version of a record, inserts a new one, and
+        indexes any owners and locations appended to its history
 
-    def insert_record(self, record_dict):
+        Args:
+            record (Record): The record's row, as decoded from state
+            block_num (int): The block the record was changed in
+        """
         update_record = """
         UPDATE records SET end_block_num = {}
         WHERE end_block_num = {} AND record_id = '{}'
         """.format(
-            record_dict['start_block_num'],
-            record_dict['end_block_num'],
-            record_dict['record_id'])
+            block_num,
+            MAX_BLOCK_NUMBER,
+            record.record_id)
 
         insert_record = """
         INSERT INTO records (
@@ -281,77 +299,163 @@ class Database(object):
         end_block_num)
         VALUES ('{}', '{}', '{}');
         """.format(
-            record_dict['record_id'],
-            record_dict['start_block_num'],
-            record_dict['end_block_num'])
+            record.record_id,
+            block_num,
+            MAX_BLOCK_NUMBER)
 
-        with self._conn.cursor() as cursor:
+        upsert_current_record = """
+        INSERT INTO records_current (
+        record_id,
+        owner,
+        owner_timestamp,
+        latitude,
+        longitude,
+        location_timestamp,
+        block_num,
+        created_at,
+        owner_count,
+        location_count)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (record_id) DO UPDATE SET
+        owner = coalesce(excluded.owner, records_current.owner),
+        owner_timestamp = coalesce(
+            excluded.owner_timestamp, records_current.owner_timestamp),
+        latitude = coalesce(excluded.latitude, records_current.latitude),
+        longitude = coalesce(excluded.longitude, records_current.longitude),
+        location_timestamp = coalesce(
+            excluded.location_timestamp, records_current.location_timestamp),
+        block_num = excluded.block_num,
+        owner_count = excluded.owner_count,
+        location_count = excluded.location_count
+        """
+
+        # The last entries of its history are the record's current owner
+        # and location. Either may be missing from a page of a long history
+        # which only appended to the other, and is then left as it was.
+        owner = record.owners[-1] if record.owners else (None, None)
+        location = (
+            record.locations[-1] if record.locations else (None, None, None))
+        # Only used when the record is first inserted, with its first owner
+        created_at = record.owners[0][-1] if record.owners else None
+
+        with self._metrics.timer('db_seconds', operation='insert_record'), \
+                self._conn.cursor() as cursor:
             cursor.execute(update_record)
             cursor.execute(insert_record)
-
-        self._insert_record_locations(record_dict)
-        self._insert_record_owners(record_dict)
-
-    def _insert_record_locations(self, record_dict):
-        update_record_locations = """
-        UPDATE record_locations SET end_block_num = {}
-        WHERE end_block_num = {} AND record_id = '{}'
-        """.format(
-            record_dict['start_block_num'],
-            record_dict['end_block_num'],
-            record_dict['record_id'])
-
-        insert_record_locations = [
-            """
-            INSERT INTO record_locations (
-            record_id,
-            latitude,
-            longitude,
-            timestamp,
-            start_block_num,
-            end_block_num)
-            VALUES ('{}', '{}', '{}', '{}', '{}', '{}');
-            """.format(
-                record_dict['record_id'],
-                location['latitude'],
-                location['longitude'],
-                location['timestamp'],
-                record_dict['start_block_num'],
-                record_dict['end_block_num'])
-            for location in record_dict['locations']
-        ]
-        with self._conn.cursor() as cursor:
-            cursor.execute(update_record_locations)
-            for insert in insert_record_locations:
-                cursor.execute(insert)
-
-    def _insert_record_owners(self, record_dict):
-        update_record_owners = """
-        UPDATE record_owners SET end_block_num = {}
-        WHERE end_block_num = {} AND record_id = '{}'
-        """.format(
-            record_dict['start_block_num'],
-            record_dict['end_block_num'],
-            record_dict['record_id'])
-
-        insert_record_owners = [
-            """
-            INSERT INTO record_owners (
-            record_id,
-            agent_id,
-            timestamp,
-            start_block_num,
-            end_block_num)
-            VALUES ('{}', '{}', '{}', '{}', '{}');
-            """.format(
-                record_dict['record_id'],
-                owner['agent_id'],
-                owner['timestamp'],
-                record_dict['start_block_num'],
-                record_dict['end_block_num'])
-            for owner in record_dict['owners']
-        ]
-        with self._conn.cursor() as cursor:
-            cursor.execute(update_record_owners)
-            for insert in insert_record_owners:
-                cursor.execute(insert)
+            history_counts = self._append_record_history(
+                cursor, record, block_num)
+            cursor.execute(
+                upsert_current_record,
+                (record.record_id,) + owner + location
+                + (block_num, created_at) + history_counts)
+        self._metrics.increment('rows_written_total', table='records')
+        self._metrics.increment('rows_written_total', table='records_current')
+
+    def _append_record_history(self, cursor, record, block_num):
+        """Indexes the owners and locations of a record which are not in the
+        database yet. A record's history only ever grows, so entries which
+        are already indexed are left in place with their original
+        start_block_num, and only the newly appended ones are inserted.
+
+        The number of entries already indexed is read from the record's
+        current row, rather than counted from its history.
+
+        Returns:
+            tuple: The numbers of owners and locations of the record indexed
+                once the new entries are inserted
+        """
+        fetch_counts = """
+        SELECT owner_count, location_count FROM records_current
+        WHERE record_id = '{}'
+        """.format(record.record_id)
+
+        cursor.execute(fetch_counts)
+        indexed = cursor.fetchone()
+        owner_count, location_count = indexed if indexed else (0, 0)
+
+        locations = _unindexed_entries(
+            record.record_id,
+            record.locations,
+            record.location_count,
+            location_count)
+        owners = _unindexed_entries(
+            record.record_id,
+            record.owners,
+            record.owner_count,
+            owner_count)
+
+        # History rows are the decoded entries, between the record's id and
+        # the range of blocks they are valid for
+        record_id = (record.record_id,)
+        block_range = (block_num, MAX_BLOCK_NUMBER)
+
+        self._insert_rows(cursor, 'record_locations', [
+            record_id + location + block_range for location in locations
+        ])
+        self._insert_rows(cursor, 'record_owners', [
+            record_id + owner + block_range for owner in owners
+        ])
+
+        return (owner_count + len(owners), location_count + len(locations))
+
+    def _insert_rows(self, cursor, table, rows):
+        """Inserts rows using multi-row VALUES lists, sending at most
+        batch_size rows per statement rather than one statement per row
+        """
+        if rows:
+            execute_values(
+                cursor,
+                INSERT_HISTORY_STMTS[table],
+                rows,
+                page_size=self._batch_size)
+            self._metrics.increment(
+                'rows_written_total', len(rows), table=table)
+
+
+def _rebuild_current_rows(cursor, block_num, table, key, statements):
+    """Deletes the current rows last changed at or after block_num, and
+    inserts them again from the versions open before that block
+    """
+    cursor.execute("""
+    DELETE FROM {} WHERE block_num >= {} RETURNING {}
+    """.format(table, block_num, key))
+    keys = [row[0] for row in cursor.fetchall()]
+
+    if keys:
+        for statement in statements:
+            cursor.execute(
+                statement.format(MAX_BLOCK_NUMBER, key + ' = ANY(%(keys)s)'),
+                {'keys': keys})
+
+
+def _rebuild_current_records(cursor, block_num):
+    """Updates the current rows of the records last changed at or after
+    block_num from the versions open before that block, and deletes those
+    of records created since. The time each record was created never
+    changes, and its history counts are adjusted beforehand, so both are
+    left as they are.
+    """
+    cursor.execute("""
+    DELETE FROM records_current
+    WHERE block_num >= {0} AND NOT EXISTS (
+        SELECT 1 FROM records
+        WHERE records.record_id = records_current.record_id
+        AND end_block_num = {1}
+    )
+    """.format(block_num, MAX_BLOCK_NUMBER))
+    cursor.execute(UPDATE_CURRENT_RECORDS_STMTS.format(
+        MAX_BLOCK_NUMBER,
+        'records_current.block_num >= {}'.format(block_num)))
+
+
+def _unindexed_entries(record_id, entries, total_count, indexed_count):
+    """Returns the trailing entries of a paged history which are not yet
+    indexed, given the total length of the history and the number of its
+    entries already in the database
+    """
+    first_index = total_count - len(entries)
+    if indexed_count < first_index:
+        LOGGER.warning(
+            'History of record %s is missing entries %s to %s',
+            record_id, indexed_count, first_index - 1)
+    return entries[max(indexed_count - first_index, 0):]
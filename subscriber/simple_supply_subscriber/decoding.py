@@ -13,25 +13,44 @@
 # limitations under the License.
 # ------------------------------------------------------------------------------
 
+from collections import namedtuple
+from itertools import accumulate
+
 from simple_supply_addressing.addresser import AddressSpace
 from simple_supply_addressing.addresser import get_address_type
 from simple_supply_protobuf.agent_pb2 import AgentContainer
 from simple_supply_protobuf.record_pb2 import RecordContainer
+from simple_supply_protobuf.record_pb2 import RecordHistoryContainer
 
 
-CONTAINERS = {
-    AddressSpace.AGENT: AgentContainer,
-    AddressSpace.RECORD: RecordContainer
-}
+PAGED_LAYOUT_VERSION = 1
+# Must match the processor, which pages a record's history out into chunks
+# of this many entries
+HISTORY_CHUNK_SIZE = 16
+
+Agent = namedtuple('Agent', ['public_key', 'name', 'timestamp'])
+
+# Owners are (agent_id, timestamp) tuples and locations are (latitude,
+# longitude, timestamp) tuples, ordered as the columns of their history
+# tables. Records may hold only the most recent entries of their history,
+# whose whole lengths are owner_count and location_count. History chunks are
+# decoded as Records too, holding either owners or locations, whose count is
+# the length of the history up to the chunk's last entry.
+Record = namedtuple(
+    'Record',
+    ['record_id', 'owners', 'locations', 'owner_count', 'location_count'])
 
 
 def deserialize_data(address, data):
     """Deserializes state data by type based on the address structure and
-    returns it as a dictionary with the associated data type
+    returns it as a list of rows with the associated data type
 
     Args:
         address (str): The state address of the container
         data (str): String containing the serialized state data
+
+    Returns:
+        tuple: The data type, and a list of Agent or Record rows
     """
     data_type = get_address_type(address)
 
@@ -39,39 +58,86 @@ def deserialize_data(address, data):
         return []
 
     try:
-        container = CONTAINERS[data_type]
+        decoder = DECODERS[data_type]
     except KeyError:
         raise TypeError('Unknown data type: {}'.format(data_type))
 
-    entries = _parse_proto(container, data).entries
-    return data_type, [_convert_proto_to_dict(pb) for pb in entries]
-
-
-def _parse_proto(proto_class, data):
-    deserialized = proto_class()
-    deserialized.ParseFromString(data)
-    return deserialized
-
-
-def _convert_proto_to_dict(proto):
-    result = {}
-
-    for field in proto.DESCRIPTOR.fields:
-        key = field.name
-        value = getattr(proto, key)
-
-        if field.type == field.TYPE_MESSAGE:
-            if field.label == field.LABEL_REPEATED:
-                result[key] = [_convert_proto_to_dict(p) for p in value]
-            else:
-                result[key] = _convert_proto_to_dict(value)
-
-        elif field.type == field.TYPE_ENUM:
-            number = int(value)
-            name = field.enum_type.values_by_number.get(number).name
-            result[key] = name
-
+    return data_type, decoder(data)
+
+
+def _decode_agents(data):
+    container = AgentContainer()
+    container.ParseFromString(data)
+    return [
+        Agent(agent.public_key, agent.name, agent.timestamp)
+        for agent in container.entries
+    ]
+
+
+def _decode_records(data):
+    container = RecordContainer()
+    container.ParseFromString(data)
+
+    records = []
+    for record in container.entries:
+        owners = _decode_owners(record)
+        locations = _decode_locations(record)
+        if record.layout_version >= PAGED_LAYOUT_VERSION:
+            records.append(Record(
+                record.record_id,
+                owners,
+                locations,
+                record.owner_count,
+                record.location_count))
         else:
-            result[key] = value
-
-    return result
+            records.append(Record(
+                record.record_id,
+                owners,
+                locations,
+                len(owners),
+                len(locations)))
+    return records
+
+
+def _decode_record_history(data):
+    container = RecordHistoryContainer()
+    container.ParseFromString(data)
+
+    records = []
+    for chunk in container.entries:
+        owners = _decode_owners(chunk)
+        locations = _decode_locations(chunk)
+        start = chunk.index * HISTORY_CHUNK_SIZE
+        records.append(Record(
+            chunk.record_id,
+            owners,
+            locations,
+            start + len(owners) if owners else 0,
+            start + len(locations) if locations else 0))
+    return records
+
+
+def _decode_owners(proto):
+    return [(owner.agent_id, owner.timestamp) for owner in proto.owners]
+
+
+def _decode_locations(proto):
+    """Decodes the locations of a record or record history chunk, including
+    any held in its packed, delta encoded columns, which precede the rest
+    """
+    packed = proto.packed_locations
+    locations = list(zip(
+        accumulate(packed.latitude_deltas),
+        accumulate(packed.longitude_deltas),
+        accumulate(packed.timestamp_deltas)))
+    locations.extend(
+        (location.latitude, location.longitude, location.timestamp)
+        for location in proto.locations)
+    return locations
+
+
+DECODERS = {
+    AddressSpace.AGENT: _decode_agents,
+    AddressSpace.RECORD: _decode_records,
+    AddressSpace.RECORD_HISTORY: _decode_record_history
+}
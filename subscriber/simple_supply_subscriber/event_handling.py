@@ -13,42 +13,177 @@
 # limitations under the License.
 # ------------------------------------------------------------------------------
 
+from collections import namedtuple
 import re
 import logging
-import math
+import time
 
 import psycopg2
 from sawtooth_sdk.protobuf.transaction_receipt_pb2 import StateChangeList
 
 from simple_supply_addressing.addresser import AddressSpace
 from simple_supply_addressing.addresser import NAMESPACE
+from simple_supply_metrics.metrics import NullMetrics
 from simple_supply_subscriber.decoding import deserialize_data
 
 
-MAX_BLOCK_NUMBER = int(math.pow(2, 63)) - 1
 NAMESPACE_REGEX = re.compile('^{}'.format(NAMESPACE))
 LOGGER = logging.getLogger(__name__)
+NULL_METRICS = NullMetrics()
 
+Block = namedtuple(
+    'Block', ['block_num', 'block_id', 'changes', 'received_at'])
 
-def get_events_handler(database):
+
+def get_events_handler(database, metrics=None):
     """Returns a events handler with a reference to a specific Database object.
     The handler takes a list of events and updates the Database appropriately.
     """
-    return lambda events: _handle_events(database, events)
+    return lambda events: apply_block(
+        database, decode_events(events, metrics), metrics)
+
+
+def decode_events(events, metrics=None, received_at=None):
+    """Parses the block and state changes of a list of events
 
+    Args:
+        events (list of Event): The events of one committed block
+        metrics (Metrics): Records the time spent decoding
+        received_at (float): The time the events were received, by default
+            now
+
+    Returns:
+        Block: The block's number and id, a list of its state changes as
+            (data type, resources) pairs, and the time it was received at
+    """
+    metrics = metrics or NULL_METRICS
+    if received_at is None:
+        received_at = time.time()
+    with metrics.timer('stage_seconds', stage='decode'):
+        block_num, block_id = _parse_new_block(events)
+        changes = [
+            deserialize_data(change.address, change.value)
+            for change in _parse_state_changes(events)
+        ]
 
-def _handle_events(database, events):
-    block_num, block_id = _parse_new_block(events)
+    return Block(block_num, block_id, changes, received_at)
+
+
+def apply_block(database, block, metrics=None):
+    """Updates the Database with a block returned by decode_events,
+    resolving any fork it causes, and commits it
+    """
+    metrics = metrics or NULL_METRICS
     try:
-        is_duplicate = _resolve_if_forked(database, block_num, block_id)
-        if not is_duplicate:
-            _apply_state_changes(database, events, block_num, block_id)
+        _apply_block(database, block, metrics)
         database.commit()
     except psycopg2.DatabaseError as err:
         LOGGER.exception('Unable to handle event: %s', err)
         database.rollback()
 
 
+class BlockApplier(object):
+    """Updates a Database with blocks returned by decode_events, grouping
+    consecutive blocks into a single transaction. A group is committed once
+    it holds group_size blocks or has been open for group_time seconds, or
+    whenever idle is called, so that a subscriber catching up with a long
+    chain commits rarely, while one at the chain head commits every block.
+
+    If a block in a group fails, the group is rolled back and its blocks
+    are applied again one transaction at a time, so only the failing block
+    is lost, just as with apply_block.
+
+    Args:
+        database (Database): The database to update
+        group_size (int): Maximum number of blocks per transaction
+        group_time (float): Maximum number of seconds a transaction is
+            left open
+        metrics (Metrics): Records the blocks applied and how far they
+            trail the blocks received
+    """
+    def __init__(self, database, group_size=1, group_time=1.0,
+                 metrics=None):
+        self._database = database
+        self._metrics = metrics or NULL_METRICS
+        self._group_size = group_size
+        self._group_time = group_time
+        self._pending = []
+        self._group_start = None
+
+    def __call__(self, block):
+        """Applies a block, committing the current group if it is full
+        """
+        if not self._pending:
+            self._group_start = time.monotonic()
+
+        try:
+            _apply_block(self._database, block, self._metrics)
+        except psycopg2.DatabaseError:
+            self._replay([block])
+            return
+
+        self._pending.append(block)
+        if (len(self._pending) >= self._group_size
+                or time.monotonic() - self._group_start >= self._group_time):
+            self.idle()
+
+    def idle(self):
+        """Commits the blocks applied since the last commit
+        """
+        if not self._pending:
+            return
+
+        try:
+            self._database.commit()
+        except psycopg2.DatabaseError:
+            self._replay([])
+            return
+
+        LOGGER.debug(
+            'Committed blocks %s to %s',
+            self._pending[0].block_num,
+            self._pending[-1].block_num)
+        self._pending = []
+
+    def _replay(self, blocks):
+        LOGGER.warning(
+            'Unable to commit a group of blocks, applying them one by one')
+        self._database.rollback()
+        blocks = self._pending + blocks
+        self._pending = []
+        for block in blocks:
+            apply_block(self._database, block, self._metrics)
+
+
+def _apply_block(database, block, metrics):
+    with metrics.timer('stage_seconds', stage='apply'):
+        is_duplicate = _resolve_if_forked(
+            database, block.block_num, block.block_id)
+        if not is_duplicate:
+            database.insert_block({
+                'block_num': block.block_num,
+                'block_id': block.block_id,
+            })
+            _apply_state_changes(database, block)
+
+    metrics.increment('blocks_total')
+    metrics.increment('state_changes_total', len(block.changes))
+    metrics.set('applied_block_num', block.block_num)
+    # The blocks received from the validator which are still waiting to be
+    # applied. The Subscriber sets received_block_num as each block arrives,
+    # so this is only above 0 while blocks queue up in the pipeline, and is
+    # always 0 when blocks are applied as they are received.
+    metrics.set(
+        'lag_blocks',
+        max(metrics.get('received_block_num') - block.block_num, 0))
+    # How long before the newest block received this one arrived, that is
+    # how far the database trails the validator's chain head. The Subscriber
+    # sets received_block_time along with received_block_num.
+    metrics.set(
+        'lag_seconds',
+        max(metrics.get('received_block_time') - block.received_at, 0))
+
+
 def _parse_new_block(events):
     try:
         block_attr = next(e.attributes for e in events
@@ -77,19 +212,59 @@ def _resolve_if_forked(database, block_num, block_id):
     return False
 
 
-def _apply_state_changes(database, events, block_num, block_id):
-    changes = _parse_state_changes(events)
-    for change in changes:
-        data_type, resources = deserialize_data(change.address, change.value)
-        database.insert_block({'block_num': block_num, 'block_id': block_id})
+def _apply_state_changes(database, block):
+    chunks = _collect_history_chunks(block.changes)
+    for data_type, resources in block.changes:
         if data_type == AddressSpace.AGENT:
-            _apply_agent_change(database, block_num, resources)
+            _apply_agent_change(database, block.block_num, resources)
         elif data_type == AddressSpace.RECORD:
-            _apply_record_change(database, block_num, resources)
+            _apply_record_change(database, block.block_num, resources, chunks)
+        elif data_type == AddressSpace.RECORD_HISTORY:
+            # Indexed with the records they were paged out of
+            continue
         else:
             LOGGER.warning('Unsupported data type: %s', data_type)
 
 
+def _collect_history_chunks(changes):
+    chunks = {}
+    for data_type, resources in changes:
+        if data_type == AddressSpace.RECORD_HISTORY:
+            for chunk in resources:
+                chunks.setdefault(chunk.record_id, []).append(chunk)
+    return chunks
+
+
+def _merge_history_chunks(record, chunks):
+    """Prepends to a record the entries of the history chunks leading up to
+    the entries it holds. A block may append more entries to a record than
+    it keeps, paging some out into chunks without the record ever holding
+    them, and this gives the database every entry appended in the block.
+    """
+    return record._replace(
+        owners=_merge_entries(
+            record.owners,
+            record.owner_count,
+            {chunk.owner_count: chunk.owners for chunk in chunks}),
+        locations=_merge_entries(
+            record.locations,
+            record.location_count,
+            {chunk.location_count: chunk.locations for chunk in chunks}))
+
+
+def _merge_entries(entries, total_count, chunks_by_end):
+    pieces = [entries]
+    start = total_count - len(entries)
+    while start > 0 and chunks_by_end.get(start):
+        chunk = chunks_by_end[start]
+        pieces.append(chunk)
+        start -= len(chunk)
+
+    if len(pieces) == 1:
+        return entries
+    return [entry for piece in reversed(pieces) for entry in piece]
+
+
 def _parse_state_changes(events):
     try:
         change_data = next(e.data for e in events
@@ -105,13 +280,11 @@ def _parse_state_changes(events):
 
 def _apply_agent_change(database, block_num, agents):
     for agent in agents:
-        agent['start_block_num'] = block_num
-        agent['end_block_num'] = MAX_BLOCK_NUMBER
-        database.insert_agent(agent)
+        database.insert_agent(agent, block_num)
 
 
-def _apply_record_change(database, block_num, records):
+def _apply_record_change(database, block_num, records, chunks):
     for record in records:
-        record['start_block_num'] = block_num
-        record['end_block_num'] = MAX_BLOCK_NUMBER
-        database.insert_record(record)
+        if record.record_id in chunks:
+            record = _merge_history_chunks(record, chunks[record.record_id])
+        database.insert_record(record, block_num)
@@ -16,14 +16,27 @@
 import argparse
 import sys
 import logging
+import time
 
+from simple_supply_metrics.metrics import start_metrics
+
+from simple_supply_subscriber.capture import CaptureReader
+from simple_supply_subscriber.capture import CaptureWriter
+from simple_supply_subscriber.capture import DEFAULT_SEGMENT_SIZE
+from simple_supply_subscriber.capture import replay
 from simple_supply_subscriber.database import Database
-from simple_supply_subscriber.subscriber import Subscriber
+from simple_supply_subscriber.database import DEFAULT_BATCH_SIZE
+from simple_supply_subscriber.event_handling import BlockApplier
+from simple_supply_subscriber.event_handling import decode_events
 from simple_supply_subscriber.event_handling import get_events_handler
+from simple_supply_subscriber.pipeline import DEFAULT_QUEUE_SIZE
+from simple_supply_subscriber.pipeline import Pipeline
+from simple_supply_subscriber.subscriber import Subscriber
 
 
 KNOWN_COUNT = 15
 LOGGER = logging.getLogger(__name__)
+METRICS_PREFIX = 'simple_supply_subscriber_'
 
 
 def parse_args(args):
@@ -53,6 +66,11 @@ def parse_args(args):
         '--db-password',
         help="The authorized user's password for database access",
         default='sawtooth')
+    database_parser.add_argument(
+        '--db-batch-size',
+        help='The maximum number of rows to insert per statement',
+        type=int,
+        default=DEFAULT_BATCH_SIZE)
     database_parser.add_argument(
         '-v', '--verbose',
         action='count',
@@ -63,15 +81,81 @@ def parse_args(args):
         'init',
         parents=[database_parser])
 
+    # Options for how events are applied to the database, whether they are
+    # received from a validator or replayed from a capture
+    handler_parser = argparse.ArgumentParser(add_help=False)
+    handler_parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Decode events and update the database on separate threads, '
+             'while receiving the next events')
+    handler_parser.add_argument(
+        '--queue-size',
+        help='The number of blocks buffered between pipeline stages',
+        type=int,
+        default=DEFAULT_QUEUE_SIZE)
+    handler_parser.add_argument(
+        '--commit-blocks',
+        help='The maximum number of blocks committed in one transaction '
+             'while catching up with the chain, requires --pipeline',
+        type=int,
+        default=1)
+    handler_parser.add_argument(
+        '--commit-interval',
+        help='The maximum number of milliseconds a transaction grouping '
+             'several blocks is left open',
+        type=int,
+        default=1000)
+    handler_parser.add_argument(
+        '--metrics-bind',
+        help='Serve subscriber metrics over HTTP at host:port/metrics')
+    handler_parser.add_argument(
+        '--metrics-interval',
+        help='Log a summary of subscriber metrics every N seconds',
+        type=float,
+        default=0)
+
     subscribe_parser = subparsers.add_parser(
         'subscribe',
-        parents=[database_parser])
+        parents=[database_parser, handler_parser])
     subscribe_parser.add_argument(
         '-C', '--connect',
         help='The url of the validator to subscribe to',
         default='tcp://localhost:4004')
+    subscribe_parser.add_argument(
+        '--capture-dir',
+        help='Append the events received to a capture in this directory, '
+             'which can be replayed with the replay subcommand')
+    subscribe_parser.add_argument(
+        '--capture-segment-size',
+        help='The number of megabytes after which a new capture segment '
+             'is started',
+        type=int,
+        default=DEFAULT_SEGMENT_SIZE // (1024 * 1024))
+
+    replay_parser = subparsers.add_parser(
+        'replay',
+        parents=[database_parser, handler_parser])
+    replay_parser.add_argument(
+        'capture_dir',
+        help='The directory of the capture to replay')
+    replay_parser.add_argument(
+        '--from-block',
+        help='The number of the first block to replay',
+        type=int)
+    replay_parser.add_argument(
+        '--speed',
+        help='Replay at this multiple of the pace the events were '
+             'received at, or as fast as possible if 0',
+        type=float,
+        default=0)
+
+    opts = parser.parse_args(args)
+    if opts.command in ('subscribe', 'replay') and opts.commit_blocks > 1 \
+            and not opts.pipeline:
+        parser.error('--commit-blocks requires --pipeline')
 
-    return parser.parse_args(args)
+    return opts
 
 
 def init_logger(level):
@@ -87,6 +171,9 @@ def init_logger(level):
 
 def do_subscribe(opts):
     LOGGER.info('Starting subscriber...')
+    database = None
+    pipeline = None
+    subscriber = None
     try:
         dsn = 'dbname={} user={} password={} host={} port={}'.format(
             opts.db_name,
@@ -95,10 +182,19 @@ def do_subscribe(opts):
             opts.db_host,
             opts.db_port)
 
-        database = Database(dsn)
+        metrics = start_metrics(opts, METRICS_PREFIX)
+        database = Database(
+            dsn, batch_size=opts.db_batch_size, metrics=metrics)
         database.connect()
-        subscriber = Subscriber(opts.connect)
-        subscriber.add_handler(get_events_handler(database))
+        capture = None
+        if opts.capture_dir:
+            capture = CaptureWriter(
+                opts.capture_dir,
+                segment_size=opts.capture_segment_size * 1024 * 1024)
+        subscriber = Subscriber(
+            opts.connect, metrics=metrics, capture=capture)
+        handler, pipeline = create_events_handler(opts, database, metrics)
+        subscriber.add_handler(handler)
         known_blocks = database.fetch_last_known_blocks(KNOWN_COUNT)
         known_ids = [block['block_id'] for block in known_blocks]
         subscriber.start(known_ids=known_ids)
@@ -111,15 +207,81 @@ def do_subscribe(opts):
         sys.exit(1)
 
     finally:
-        try:
+        if pipeline is not None:
+            pipeline.stop()
+        if database is not None:
             database.disconnect()
+        if subscriber is not None:
             subscriber.stop()
-        except UnboundLocalError:
-            pass
 
     LOGGER.info('Subscriber shut down successfully')
 
 
+def do_replay(opts):
+    LOGGER.info('Replaying events from %s...', opts.capture_dir)
+    database = None
+    pipeline = None
+    try:
+        dsn = 'dbname={} user={} password={} host={} port={}'.format(
+            opts.db_name,
+            opts.db_user,
+            opts.db_password,
+            opts.db_host,
+            opts.db_port)
+
+        reader = CaptureReader(opts.capture_dir)
+        metrics = start_metrics(opts, METRICS_PREFIX)
+        database = Database(
+            dsn, batch_size=opts.db_batch_size, metrics=metrics)
+        database.connect()
+        handler, pipeline = create_events_handler(opts, database, metrics)
+        replay(
+            reader, handler, from_block=opts.from_block, speed=opts.speed)
+
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+    except Exception as err:  # pylint: disable=broad-except
+        LOGGER.exception(err)
+        sys.exit(1)
+
+    finally:
+        if pipeline is not None:
+            pipeline.stop()
+        if database is not None:
+            database.disconnect()
+
+    LOGGER.info('Replay finished successfully')
+
+
+def create_events_handler(opts, database, metrics):
+    """Creates the handler passed the events of each block, returning it
+    and the Pipeline it puts them into, or None if they are applied on the
+    calling thread
+    """
+    if not opts.pipeline:
+        return get_events_handler(database, metrics), None
+
+    block_applier = BlockApplier(
+        database,
+        group_size=opts.commit_blocks,
+        group_time=opts.commit_interval / 1000,
+        metrics=metrics)
+    pipeline = Pipeline(
+        [lambda item: decode_events(item[0], metrics, received_at=item[1]),
+         block_applier],
+        queue_size=opts.queue_size,
+        metrics=metrics)
+    pipeline.start()
+
+    # Events are stamped as they are received rather than once decoded, so
+    # lag_seconds includes the time they spend queued
+    def put_events(events):
+        pipeline.put((events, time.time()))
+
+    return put_events, pipeline
+
+
 def do_init(opts):
     LOGGER.info('Initializing subscriber...')
     try:
@@ -131,7 +293,7 @@ def do_init(opts):
             opts.db_port)
         database = Database(dsn)
         database.connect()
-        database.create_tables()
+        database.migrate()
 
     except Exception as err:  # pylint: disable=broad-except
         LOGGER.exception('Unable to initialize subscriber database: %s', err)
@@ -146,6 +308,8 @@ def main():
 
     if opts.command == 'subscribe':
         do_subscribe(opts)
+    elif opts.command == 'replay':
+        do_replay(opts)
     elif opts.command == 'init':
         do_init(opts)
     else:
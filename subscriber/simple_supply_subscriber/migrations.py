@@ -0,0 +1,473 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import logging
+import math
+from collections import namedtuple
+
+
+LOGGER = logging.getLogger(__name__)
+MAX_BLOCK_NUMBER = int(math.pow(2, 63)) - 1
+
+# Tables whose rows are versioned by the range of blocks they are valid for
+VERSIONED_TABLES = ['agents', 'records', 'record_locations', 'record_owners']
+
+# Tables holding only the latest version of each resource, keyed by the
+# block it was last changed in
+CURRENT_TABLES = ['agents_current', 'records_current']
+
+Migration = namedtuple(
+    'Migration', ['version', 'description', 'statements', 'concurrent'])
+
+
+CREATE_SCHEMA_VERSION_STMTS = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version      integer PRIMARY KEY,
+    description  varchar,
+    applied_at   timestamp DEFAULT now()
+);
+"""
+
+
+CREATE_BLOCK_STMTS = """
+CREATE TABLE IF NOT EXISTS blocks (
+    block_num  bigint PRIMARY KEY,
+    block_id   varchar
+);
+"""
+
+
+CREATE_AUTH_STMTS = """
+CREATE TABLE IF NOT EXISTS auth (
+    public_key            varchar PRIMARY KEY,
+    hashed_password       varchar,
+    encrypted_private_key varchar
+)
+"""
+
+
+CREATE_RECORD_STMTS = """
+CREATE TABLE IF NOT EXISTS records (
+    id               bigserial PRIMARY KEY,
+    record_id        varchar,
+    start_block_num  bigint,
+    end_block_num    bigint
+);
+"""
+
+
+CREATE_RECORD_LOCATION_STMTS = """
+CREATE TABLE IF NOT EXISTS record_locations (
+    id               bigserial PRIMARY KEY,
+    record_id        varchar,
+    latitude         bigint,
+    longitude        bigint,
+    timestamp        bigint,
+    start_block_num  bigint,
+    end_block_num    bigint
+);
+"""
+
+
+CREATE_RECORD_OWNER_STMTS = """
+CREATE TABLE IF NOT EXISTS record_owners (
+    id               bigserial PRIMARY KEY,
+    record_id        varchar,
+    agent_id         varchar,
+    timestamp        bigint,
+    start_block_num  bigint,
+    end_block_num    bigint
+);
+"""
+
+
+CREATE_AGENT_STMTS = """
+CREATE TABLE IF NOT EXISTS agents (
+    id               bigserial PRIMARY KEY,
+    public_key       varchar,
+    name             varchar,
+    timestamp        bigint,
+    start_block_num  bigint,
+    end_block_num    bigint
+);
+"""
+
+
+# Earlier versions closed every history row of a record whenever it changed
+# and re-inserted its whole history. This keeps one open row per entry, which
+# takes the start_block_num of the entry's first row, and drops the rest.
+COLLAPSE_RECORD_LOCATIONS_STMTS = """
+UPDATE record_locations AS current
+SET start_block_num = earliest.start_block_num
+FROM (
+    SELECT record_id, latitude, longitude, timestamp,
+    min(start_block_num) AS start_block_num
+    FROM record_locations
+    GROUP BY record_id, latitude, longitude, timestamp
+) AS earliest
+WHERE current.end_block_num = {0}
+AND current.record_id = earliest.record_id
+AND current.latitude = earliest.latitude
+AND current.longitude = earliest.longitude
+AND current.timestamp = earliest.timestamp
+AND current.start_block_num > earliest.start_block_num;
+DELETE FROM record_locations WHERE end_block_num <> {0};
+""".format(MAX_BLOCK_NUMBER)
+
+
+COLLAPSE_RECORD_OWNERS_STMTS = """
+UPDATE record_owners AS current
+SET start_block_num = earliest.start_block_num
+FROM (
+    SELECT record_id, agent_id, timestamp,
+    min(start_block_num) AS start_block_num
+    FROM record_owners
+    GROUP BY record_id, agent_id, timestamp
+) AS earliest
+WHERE current.end_block_num = {0}
+AND current.record_id = earliest.record_id
+AND current.agent_id = earliest.agent_id
+AND current.timestamp = earliest.timestamp
+AND current.start_block_num > earliest.start_block_num;
+DELETE FROM record_owners WHERE end_block_num <> {0};
+""".format(MAX_BLOCK_NUMBER)
+
+
+# Forks are rolled back by the blocks rows were created and closed in. Most
+# rows are open, so only closed ones are indexed by end_block_num.
+CREATE_FORK_INDEX_STMTS = """
+CREATE INDEX IF NOT EXISTS {0}_start_block_num_idx
+ON {0} (start_block_num);
+CREATE INDEX IF NOT EXISTS {0}_end_block_num_idx
+ON {0} (end_block_num) WHERE end_block_num < {1};
+"""
+
+
+# The latest version of each agent and record, so that reads of the head of
+# the chain are primary key lookups rather than range scans of the history.
+# A record's row also holds its current owner and location, the last entries
+# of its history.
+CREATE_CURRENT_STMTS = """
+CREATE TABLE IF NOT EXISTS agents_current (
+    public_key  varchar PRIMARY KEY,
+    name        varchar,
+    timestamp   bigint,
+    block_num   bigint
+);
+CREATE TABLE IF NOT EXISTS records_current (
+    record_id           varchar PRIMARY KEY,
+    owner               varchar,
+    owner_timestamp     bigint,
+    latitude            bigint,
+    longitude           bigint,
+    location_timestamp  bigint,
+    block_num           bigint
+);
+CREATE INDEX IF NOT EXISTS agents_current_block_num_idx
+ON agents_current (block_num);
+CREATE INDEX IF NOT EXISTS records_current_block_num_idx
+ON records_current (block_num);
+"""
+
+
+# Rebuild the current rows of agents and records from their open versions.
+# {0} is MAX_BLOCK_NUMBER and {1} a condition on the key of the resources to
+# rebuild, which is TRUE when the tables are first populated.
+INSERT_CURRENT_AGENTS_STMTS = """
+INSERT INTO agents_current (public_key, name, timestamp, block_num)
+SELECT public_key, name, timestamp, start_block_num
+FROM agents
+WHERE end_block_num = {0} AND {1}
+"""
+
+
+INSERT_CURRENT_RECORDS_STMTS = """
+INSERT INTO records_current (
+    record_id, owner, owner_timestamp,
+    latitude, longitude, location_timestamp, block_num)
+SELECT record_id,
+owners.agent_id, owners.timestamp,
+locations.latitude, locations.longitude, locations.timestamp,
+records.start_block_num
+FROM records
+LEFT JOIN (
+    SELECT DISTINCT ON (record_id) record_id, agent_id, timestamp
+    FROM record_owners
+    WHERE end_block_num = {0} AND {1}
+    ORDER BY record_id, id DESC
+) AS owners USING (record_id)
+LEFT JOIN (
+    SELECT DISTINCT ON (record_id) record_id, latitude, longitude, timestamp
+    FROM record_locations
+    WHERE end_block_num = {0} AND {1}
+    ORDER BY record_id, id DESC
+) AS locations USING (record_id)
+WHERE records.end_block_num = {0} AND {1}
+"""
+
+
+# Updates the current rows of a few records, such as those changed by a
+# fork, from their open versions. The latest owner and location of each
+# record are looked up by index, rather than by sorting their whole history
+# as INSERT_CURRENT_RECORDS_STMTS does. {0} is MAX_BLOCK_NUMBER and {1} a
+# condition on the current rows to update.
+UPDATE_CURRENT_RECORDS_STMTS = """
+UPDATE records_current SET
+owner = owners.agent_id,
+owner_timestamp = owners.timestamp,
+latitude = locations.latitude,
+longitude = locations.longitude,
+location_timestamp = locations.timestamp,
+block_num = records.start_block_num
+FROM records
+LEFT JOIN LATERAL (
+    SELECT agent_id, timestamp FROM record_owners
+    WHERE record_owners.record_id = records.record_id
+    AND end_block_num = {0}
+    ORDER BY id DESC LIMIT 1
+) AS owners ON TRUE
+LEFT JOIN LATERAL (
+    SELECT latitude, longitude, timestamp FROM record_locations
+    WHERE record_locations.record_id = records.record_id
+    AND end_block_num = {0}
+    ORDER BY id DESC LIMIT 1
+) AS locations ON TRUE
+WHERE records.record_id = records_current.record_id
+AND records.end_block_num = {0} AND {1}
+"""
+
+
+# The time a record was created is that of its first owner. {0} is
+# MAX_BLOCK_NUMBER and {1} a condition on the record_id of the records to
+# update, as for INSERT_CURRENT_RECORDS_STMTS.
+UPDATE_CURRENT_CREATED_AT_STMTS = """
+UPDATE records_current SET created_at = (
+    SELECT min(timestamp) FROM record_owners
+    WHERE record_owners.record_id = records_current.record_id
+    AND end_block_num = {0}
+)
+WHERE {1}
+"""
+
+
+# The number of owners and locations of each record which are indexed, so
+# that only the entries appended after them are inserted. {0} is
+# MAX_BLOCK_NUMBER and {1} a condition on the record_id of the records to
+# update, as for INSERT_CURRENT_RECORDS_STMTS.
+UPDATE_CURRENT_HISTORY_COUNTS_STMTS = """
+UPDATE records_current SET
+owner_count = (
+    SELECT count(*) FROM record_owners
+    WHERE record_owners.record_id = records_current.record_id
+    AND end_block_num = {0}
+),
+location_count = (
+    SELECT count(*) FROM record_locations
+    WHERE record_locations.record_id = records_current.record_id
+    AND end_block_num = {0}
+)
+WHERE {1}
+"""
+
+
+# The REST API pages through agents and records by their key, or by a time
+# they are filtered by and then their key
+CREATE_PAGING_INDEX_STMTS = """
+CREATE INDEX IF NOT EXISTS agents_current_timestamp_idx
+ON agents_current (timestamp, public_key);
+CREATE INDEX IF NOT EXISTS records_current_owner_idx
+ON records_current (owner, record_id);
+CREATE INDEX IF NOT EXISTS records_current_created_at_idx
+ON records_current (created_at, record_id);
+CREATE INDEX IF NOT EXISTS records_current_updated_at_idx
+ON records_current (
+    (greatest(owner_timestamp, location_timestamp)), record_id);
+"""
+
+
+# The REST API looks resources up by their key at the latest block, that is
+# key = ? AND start_block_num <= head AND head < end_block_num
+LOOKUP_INDEXES = [
+    ('agents', 'public_key'),
+    ('records', 'record_id'),
+    ('record_locations', 'record_id'),
+    ('record_owners', 'record_id'),
+]
+
+
+# The latest entries of a record's history are looked up in the order they
+# were appended when its current row is rebuilt
+HISTORY_ORDER_INDEXES = [
+    ('record_locations', 'record_id, id'),
+    ('record_owners', 'record_id, id'),
+]
+
+
+def _create_lookup_indexes():
+    return _create_indexes_concurrently([
+        ('{}_{}_block_idx'.format(table, column),
+         table,
+         '{}, end_block_num, start_block_num'.format(column))
+        for table, column in LOOKUP_INDEXES
+    ])
+
+
+def _create_history_order_indexes():
+    return _create_indexes_concurrently([
+        ('{}_record_id_id_idx'.format(table), table, columns)
+        for table, columns in HISTORY_ORDER_INDEXES
+    ])
+
+
+def _create_indexes_concurrently(indexes):
+    # An interrupted concurrent build leaves an invalid index behind, which
+    # is dropped before building it again
+    statements = []
+    for name, table, columns in indexes:
+        statements.append(
+            'DROP INDEX CONCURRENTLY IF EXISTS {}'.format(name))
+        statements.append(
+            'CREATE INDEX CONCURRENTLY {} ON {} ({})'.format(
+                name, table, columns))
+    return statements
+
+
+# Schema versions in the order they are applied. Versions are never edited
+# once released, changes to the schema are made by appending a new one.
+MIGRATIONS = [
+    Migration(
+        version=1,
+        description='Create the Simple Supply tables',
+        statements=[
+            CREATE_BLOCK_STMTS,
+            CREATE_AUTH_STMTS,
+            CREATE_RECORD_STMTS,
+            CREATE_RECORD_LOCATION_STMTS,
+            CREATE_RECORD_OWNER_STMTS,
+            CREATE_AGENT_STMTS,
+        ],
+        concurrent=False),
+    Migration(
+        version=2,
+        description='Store one row per record owner and location',
+        statements=[
+            COLLAPSE_RECORD_LOCATIONS_STMTS,
+            COLLAPSE_RECORD_OWNERS_STMTS,
+        ],
+        concurrent=False),
+    Migration(
+        version=3,
+        description='Index rows by the blocks they were created and closed in',
+        statements=[
+            CREATE_FORK_INDEX_STMTS.format(table, MAX_BLOCK_NUMBER)
+            for table in VERSIONED_TABLES
+        ],
+        concurrent=False),
+    Migration(
+        version=4,
+        description='Index rows by the keys the REST API looks them up by',
+        statements=_create_lookup_indexes(),
+        concurrent=True),
+    Migration(
+        version=5,
+        description='Keep the latest version of each agent and record',
+        statements=[
+            CREATE_CURRENT_STMTS,
+            INSERT_CURRENT_AGENTS_STMTS.format(MAX_BLOCK_NUMBER, 'TRUE'),
+            INSERT_CURRENT_RECORDS_STMTS.format(MAX_BLOCK_NUMBER, 'TRUE'),
+        ],
+        concurrent=False),
+    Migration(
+        version=6,
+        description='Index agents and records by the REST API filters',
+        statements=[
+            'ALTER TABLE records_current '
+            'ADD COLUMN IF NOT EXISTS created_at bigint',
+            UPDATE_CURRENT_CREATED_AT_STMTS.format(MAX_BLOCK_NUMBER, 'TRUE'),
+            CREATE_PAGING_INDEX_STMTS,
+        ],
+        concurrent=False),
+    Migration(
+        version=7,
+        description='Count the indexed history of each record',
+        statements=[
+            'ALTER TABLE records_current '
+            'ADD COLUMN IF NOT EXISTS owner_count bigint NOT NULL DEFAULT 0',
+            'ALTER TABLE records_current '
+            'ADD COLUMN IF NOT EXISTS location_count bigint NOT NULL '
+            'DEFAULT 0',
+            UPDATE_CURRENT_HISTORY_COUNTS_STMTS.format(
+                MAX_BLOCK_NUMBER, 'TRUE'),
+        ],
+        concurrent=False),
+    Migration(
+        version=8,
+        description='Index the history of each record in append order',
+        statements=_create_history_order_indexes(),
+        concurrent=True),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def apply_migrations(conn):
+    """Upgrades the database to the latest schema version, applying each
+    missing version in order and recording it in the schema_version table.
+    Databases created before versions were recorded are upgraded from the
+    start, as the earliest versions can safely be applied again.
+
+    Most versions are applied in a single transaction. Concurrent versions
+    run their statements outside of a transaction, so that they can build
+    indexes without blocking a running subscriber's writes.
+
+    Args:
+        conn (psycopg2.connection): An open connection to the database
+    """
+    current_version = _fetch_schema_version(conn)
+
+    for migration in MIGRATIONS:
+        if migration.version <= current_version:
+            continue
+
+        LOGGER.info(
+            'Applying schema version %s: %s',
+            migration.version,
+            migration.description)
+
+        conn.autocommit = migration.concurrent
+        try:
+            with conn.cursor() as cursor:
+                for statement in migration.statements:
+                    cursor.execute(statement)
+                cursor.execute(
+                    'INSERT INTO schema_version (version, description) '
+                    'VALUES (%s, %s)',
+                    (migration.version, migration.description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = False
+
+    LOGGER.info('Database is at schema version %s', LATEST_VERSION)
+
+
+def _fetch_schema_version(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(CREATE_SCHEMA_VERSION_STMTS)
+        cursor.execute('SELECT coalesce(max(version), 0) FROM schema_version')
+        version = cursor.fetchone()[0]
+    conn.commit()
+    return version
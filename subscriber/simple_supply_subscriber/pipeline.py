@@ -0,0 +1,151 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import logging
+import queue
+import threading
+import time
+
+from simple_supply_metrics.metrics import NullMetrics
+
+
+LOGGER = logging.getLogger(__name__)
+DEFAULT_QUEUE_SIZE = 64
+POLL_INTERVAL = 0.5
+STOP_TIMEOUT = 60
+
+_STOP = object()
+
+
+class Pipeline(object):
+    """Runs a series of stages, each on its own thread, connected by bounded
+    queues. Every item put into the pipeline is passed to the first stage,
+    its result to the second, and so on. Items move through each stage in
+    the order they were put, and put blocks while the first queue is full,
+    so a slow stage holds back the ones before it.
+
+    A stage may also have an idle method, which is called whenever the
+    stage has caught up with every item queued for it, and once more
+    before it stops.
+
+    Args:
+        stages (list of callable): Functions each taking the result of the
+            previous stage
+        queue_size (int): Maximum number of items waiting for each stage
+        metrics (Metrics): Records the number of items waiting for each
+            stage
+    """
+    def __init__(self, stages, queue_size=DEFAULT_QUEUE_SIZE, metrics=None):
+        self._metrics = metrics or NullMetrics()
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self._threads = [
+            threading.Thread(
+                target=self._run_stage,
+                args=(stage, index),
+                name='pipeline-stage-{}'.format(index),
+                daemon=True)
+            for index, stage in enumerate(stages)
+        ]
+        self._error = None
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, item):
+        """Queues an item for the first stage, waiting for room if it is
+        full
+
+        Raises:
+            RuntimeError: A stage failed, so the pipeline is no longer
+                processing items
+        """
+        while True:
+            self._check_error()
+            try:
+                self._queues[0].put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Waits for queued items to pass through every stage, then stops
+        the stage threads. Stages which have not caught up within timeout
+        seconds, or are stuck behind one which failed, are left to exit on
+        their own.
+        """
+        deadline = time.time() + timeout
+        while self._threads[0].is_alive():
+            try:
+                self._queues[0].put(_STOP, timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                if self._error is not None or time.time() >= deadline:
+                    LOGGER.warning('Pipeline is not draining, so items '
+                                   'still queued are dropped')
+                    break
+
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join(max(deadline - time.time(), 0))
+            if thread.is_alive():
+                LOGGER.warning('Pipeline stage %s did not stop within %ss',
+                               thread.name, timeout)
+
+    def _run_stage(self, stage, index):
+        inbox = self._queues[index]
+        try:
+            outbox = self._queues[index + 1]
+        except IndexError:
+            outbox = None
+
+        idle = getattr(stage, 'idle', None)
+
+        while True:
+            try:
+                if idle is not None and inbox.empty():
+                    idle()
+                item = inbox.get()
+                self._metrics.set('queue_depth', inbox.qsize(), stage=index)
+                if item is _STOP or self._error is not None:
+                    if idle is not None and self._error is None:
+                        idle()
+                    break
+
+                result = stage(item)
+            except Exception as err:  # pylint: disable=broad-except
+                LOGGER.exception('Pipeline stage %s failed', index)
+                self._error = err
+                break
+
+            if outbox is not None:
+                self._put_next(outbox, result)
+
+        if outbox is not None:
+            self._put_next(outbox, _STOP)
+
+    def _put_next(self, outbox, item):
+        while True:
+            try:
+                outbox.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                if self._error is not None:
+                    return
+
+    def _check_error(self):
+        if self._error is not None:
+            raise RuntimeError(
+                'Event pipeline stopped: {}'.format(self._error))
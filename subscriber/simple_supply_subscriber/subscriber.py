@@ -14,6 +14,7 @@
 # ------------------------------------------------------------------------------
 
 import logging
+import time
 
 from sawtooth_sdk.protobuf.client_event_pb2 import ClientEventsSubscribeRequest
 from sawtooth_sdk.protobuf.client_event_pb2\
@@ -29,6 +30,8 @@ from sawtooth_sdk.protobuf.validator_pb2 import Message
 from sawtooth_sdk.messaging.stream import Stream
 
 from simple_supply_addressing.addresser import NAMESPACE
+from simple_supply_metrics.metrics import NullMetrics
+from simple_supply_subscriber.capture import parse_block_num
 
 
 LOGGER = logging.getLogger(__name__)
@@ -39,12 +42,21 @@ class Subscriber(object):
     """Creates an object that can subscribe to state delta events using the
     Sawtooth SDK's Stream class. Handler functions can be added prior to
     subscribing, and each will be called on each delta event received.
+
+    Args:
+        validator_url (str): The url of the validator to subscribe to
+        metrics (Metrics): Records the time spent waiting for and parsing
+            events, and the number of the latest block received
+        capture (CaptureWriter): Records the event lists received, so that
+            they can be replayed later
     """
-    def __init__(self, validator_url):
+    def __init__(self, validator_url, metrics=None, capture=None):
         LOGGER.info('Connecting to validator: %s', validator_url)
         self._stream = Stream(validator_url)
         self._event_handlers = []
         self._is_active = False
+        self._metrics = metrics or NullMetrics()
+        self._capture = capture
 
     def add_handler(self, handler):
         """Adds a handler which will be passed state delta events when they
@@ -99,10 +111,19 @@ class Subscriber(object):
 
         LOGGER.debug('Successfully subscribed to state delta events')
         while self._is_active:
-            message_future = self._stream.receive()
-
-            event_list = EventList()
-            event_list.ParseFromString(message_future.result().content)
+            with self._metrics.timer('stream_wait_seconds'):
+                message = self._stream.receive().result()
+            received_at = time.time()
+
+            with self._metrics.timer('stage_seconds', stage='receive'):
+                event_list = EventList()
+                event_list.ParseFromString(message.content)
+            block_num = parse_block_num(event_list.events)
+            if block_num is not None:
+                self._metrics.set('received_block_num', block_num)
+                self._metrics.set('received_block_time', received_at)
+            if self._capture is not None:
+                self._capture.write(message.content, event_list.events)
             for handler in self._event_handlers:
                 handler(event_list.events)
 
@@ -126,3 +147,5 @@ class Subscriber(object):
                 ClientEventsUnsubscribeResponse.Status.Name(response.status))
 
         self._stream.close()
+        if self._capture is not None:
+            self._capture.close()
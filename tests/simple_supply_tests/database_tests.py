@@ -0,0 +1,365 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import asyncio
+import random
+import select
+import time
+import unittest
+
+from aiohttp.web import Response
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from sawtooth_sdk.protobuf.events_pb2 import Event
+from sawtooth_sdk.protobuf.transaction_receipt_pb2 import StateChange
+from sawtooth_sdk.protobuf.transaction_receipt_pb2 import StateChangeList
+
+from simple_supply_benchmarks.context import InMemoryContext
+from simple_supply_benchmarks.workloads import update_chain
+from simple_supply_protobuf import payload_pb2
+
+from simple_supply_rest_api.cache import ResponseCache
+from simple_supply_rest_api.database import AGENT_CREATED_AT
+from simple_supply_rest_api.database import BLOCKS_CHANNEL
+from simple_supply_rest_api.database import FETCH_AGENTS
+from simple_supply_rest_api.database import FETCH_RECORDS
+from simple_supply_rest_api.database import RECORD_CREATED_AT
+from simple_supply_rest_api.database import RECORD_UPDATED_AT
+from simple_supply_rest_api.database import Database as RestDatabase
+from simple_supply_subscriber.database import Database
+from simple_supply_subscriber.decoding import Agent
+from simple_supply_subscriber.decoding import Record
+from simple_supply_subscriber.event_handling import get_events_handler
+from simple_supply_subscriber.migrations import LATEST_VERSION
+from simple_supply_tp.handler import SimpleSupplyHandler
+from simple_supply_tp.state import HISTORY_CHUNK_SIZE
+from simple_supply_tp.state import RECENT_HISTORY_SIZE
+
+
+DSN = 'dbname=simple-supply user=sawtooth password=sawtooth host=postgres'
+
+# The queries the REST API runs for a single agent and record, with the
+# indexes each is expected to be answered with
+HOT_QUERIES = [
+    (FETCH_AGENTS + "WHERE public_key='{}'".format('02' * 33), [
+        'agents_current_pkey',
+    ]),
+    (FETCH_RECORDS + "WHERE record_id='record'", [
+        'records_current_pkey',
+        'record_locations_record_id_block_idx',
+        'record_owners_record_id_block_idx',
+    ]),
+]
+
+# The queries the REST API pages through filtered lists of agents and
+# records with, with the index each is expected to be answered with
+PAGE_QUERY = 'SELECT {0} FROM {1} WHERE {2} >= 1 ORDER BY {2}, {0} LIMIT 101'
+PAGE_QUERIES = [
+    (PAGE_QUERY.format('public_key', 'agents_current', AGENT_CREATED_AT), [
+        'agents_current_timestamp_idx',
+    ]),
+    (PAGE_QUERY.format('record_id', 'records_current', RECORD_CREATED_AT), [
+        'records_current_created_at_idx',
+    ]),
+    (PAGE_QUERY.format('record_id', 'records_current', RECORD_UPDATED_AT), [
+        'records_current_updated_at_idx',
+    ]),
+    ("SELECT record_id FROM records_current WHERE owner = '{}' "
+     "ORDER BY record_id LIMIT 101".format('02' * 33), [
+         'records_current_owner_idx',
+     ]),
+]
+
+
+class SimpleSupplyDatabaseTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = psycopg2.connect(DSN)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def test_00_schema_version(self):
+        """ Tests that init applied every schema version.
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute('SELECT max(version) FROM schema_version')
+            self.assertEqual(cursor.fetchone()[0], LATEST_VERSION)
+
+    def test_01_hot_queries_use_indexes(self):
+        """ Tests that the REST API's per resource queries are answered
+        with scans of the current tables' primary keys and of the lookup
+        indexes of the history tables, and that its filtered pages are
+        read from the paging indexes.
+
+        Notes:
+            The test tables are nearly empty, so sequential scans are
+            disabled to check that a matching index exists, rather than
+            whether the planner prefers it at this size.
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            for query, indexes in HOT_QUERIES + PAGE_QUERIES:
+                cursor.execute('EXPLAIN ' + query)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+
+                self.assertNotIn(
+                    'Seq Scan', plan, 'Sequential scan:\n{}'.format(plan))
+                for index in indexes:
+                    self.assertIn(
+                        index,
+                        plan,
+                        'Index {} not used:\n{}'.format(index, plan))
+
+    def test_02_drop_fork_restores_current_rows(self):
+        """ Tests that rolling back a fork restores the current rows of
+        the agents and records it changed, with the counts of their indexed
+        history, and deletes those it created.
+        """
+        database = Database(DSN)
+        database.connect()
+        try:
+            database.insert_agent(Agent('02' * 33, 'agent', 1), 1)
+            database.insert_record(
+                Record('record', (('02' * 33, 1),), ((1, 2, 1),), 1, 1), 1)
+
+            database.insert_agent(Agent('02' * 33, 'renamed', 2), 2)
+            database.insert_agent(Agent('03' * 33, 'forked', 2), 2)
+            database.insert_record(
+                Record('record', (), ((3, 4, 2),), 1, 2), 2)
+            database.insert_record(
+                Record('forked', (('03' * 33, 2),), (), 1, 0), 2)
+
+            database.drop_fork(2)
+
+            with database._conn.cursor() as cursor:
+                cursor.execute(
+                    'SELECT public_key, name, block_num FROM agents_current')
+                self.assertEqual(cursor.fetchall(), [('02' * 33, 'agent', 1)])
+
+                cursor.execute(
+                    'SELECT record_id, owner, latitude, longitude, block_num, '
+                    'created_at, owner_count, location_count '
+                    'FROM records_current')
+                self.assertEqual(
+                    cursor.fetchall(),
+                    [('record', '02' * 33, 1, 2, 1, 1, 1, 1)])
+        finally:
+            database.rollback()
+            database.disconnect()
+
+    def test_03_records_aggregate_history(self):
+        """ Tests that the REST API's record query returns each record with
+        its owners and locations, in the order they were appended.
+        """
+        database = Database(DSN)
+        database.connect()
+        try:
+            database.insert_record(
+                Record('record', (('02' * 33, 1),), ((1, 2, 1),), 1, 1), 1)
+            database.insert_record(
+                Record('record', (('03' * 33, 2),), ((3, 4, 2),), 2, 2), 2)
+
+            with database._conn.cursor(cursor_factory=RealDictCursor) \
+                    as cursor:
+                cursor.execute(FETCH_RECORDS)
+                self.assertEqual(cursor.fetchall(), [{
+                    'record_id': 'record',
+                    'locations': [
+                        {'latitude': 1, 'longitude': 2, 'timestamp': 1},
+                        {'latitude': 3, 'longitude': 4, 'timestamp': 2},
+                    ],
+                    'owners': [
+                        {'agent_id': '02' * 33, 'timestamp': 1},
+                        {'agent_id': '03' * 33, 'timestamp': 2},
+                    ],
+                }])
+        finally:
+            database.rollback()
+            database.disconnect()
+
+    def test_04_committed_blocks_are_notified(self):
+        """ Tests that the REST API is notified of each block the subscriber
+        commits, and of none it rolls back.
+        """
+        listener = psycopg2.connect(DSN)
+        listener.autocommit = True
+        database = Database(DSN)
+        database.connect()
+        try:
+            with listener.cursor() as cursor:
+                cursor.execute('LISTEN {}'.format(BLOCKS_CHANNEL))
+
+            database.insert_block({'block_num': 1, 'block_id': 'rolled'})
+            database.rollback()
+            database.insert_block({'block_num': 1, 'block_id': 'committed'})
+            database.commit()
+
+            select.select([listener], [], [], 5)
+            listener.poll()
+            self.assertEqual(
+                [(notify.channel, notify.payload)
+                 for notify in listener.notifies],
+                [(BLOCKS_CHANNEL, 'committed')])
+        finally:
+            database.rollback()
+            database.drop_fork(1)
+            database.commit()
+            database.disconnect()
+            listener.close()
+
+    def test_05_history_paged_out_within_a_block(self):
+        """ Tests that every location of a record is indexed when a single
+        block appends more of them than the record and the last history
+        chunk hold, so that some are only found in chunks paged out earlier
+        in the block.
+        """
+        setup, updates = update_chain(
+            2 * (RECENT_HISTORY_SIZE + HISTORY_CHUNK_SIZE), random.Random(5))
+        database = Database(DSN)
+        database.connect()
+        handler = SimpleSupplyHandler()
+        context = InMemoryContext()
+        handle_events = get_events_handler(database)
+        expected = []
+        try:
+            for block_num, transactions in enumerate([setup, updates], 1):
+                state = context.state
+                for transaction in transactions:
+                    handler.apply(transaction, context)
+                    payload = payload_pb2.SimpleSupplyPayload.FromString(
+                        transaction.payload)
+                    if payload.HasField('create_record'):
+                        location = payload.create_record
+                    elif payload.HasField('update_record'):
+                        location = payload.update_record
+                    else:
+                        continue
+                    expected.append((location.latitude,
+                                     location.longitude,
+                                     payload.timestamp))
+                handle_events(_make_block_events(block_num, {
+                    address: data
+                    for address, data in context.state.items()
+                    if state.get(address) != data
+                }))
+
+            with self.conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT latitude, longitude, timestamp "
+                    "FROM record_locations WHERE record_id='chain' "
+                    "ORDER BY id")
+                self.assertEqual(
+                    [tuple(row) for row in cursor.fetchall()], expected)
+        finally:
+            database.rollback()
+            database.drop_fork(1)
+            database.commit()
+            database.disconnect()
+
+    def test_06_head_block_tracked_across_reconnects(self):
+        """ Tests that the REST API stops serving cached responses when its
+        connection tracking the head block is lost, and caches them again
+        once it has reconnected.
+        """
+        database = Database(DSN)
+        database.connect()
+        loop = asyncio.new_event_loop()
+        rest_database = RestDatabase(
+            'postgres', 5432, 'simple-supply', 'sawtooth', 'sawtooth', loop)
+        cache = ResponseCache()
+        heads = []
+        reads = []
+
+        def set_head_block(block_id):
+            heads.append(block_id)
+            cache.set_head_block(block_id)
+
+        async def read(request):
+            reads.append(request.path)
+            return Response(body=b'{}')
+
+        cached_read = cache.cached(read)
+        request = _Request('/records')
+
+        def wait_for_head(count):
+            deadline = time.time() + 10
+            while time.time() < deadline:
+                if heads[count:].count('head') > 0:
+                    return
+                loop.run_until_complete(asyncio.sleep(0.1))
+            self.fail('Head block not tracked: {}'.format(heads))
+
+        watcher = loop.create_task(
+            rest_database.watch_head_block(set_head_block, retry_delay=0.1))
+        try:
+            database.insert_block({'block_num': 1, 'block_id': 'head'})
+            database.commit()
+
+            wait_for_head(0)
+            for _ in range(2):
+                loop.run_until_complete(cached_read(request))
+            self.assertEqual(len(reads), 1)
+
+            # The connection tracking the head last read it from blocks
+            with self.conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                    "WHERE pid <> pg_backend_pid() "
+                    "AND query LIKE '%FROM blocks ORDER BY block_num%'")
+                self.assertEqual(cursor.fetchall(), [(True,)])
+            count = len(heads)
+            wait_for_head(count)
+
+            self.assertIn(None, heads[count:])
+            for _ in range(2):
+                loop.run_until_complete(cached_read(request))
+            self.assertEqual(len(reads), 2)
+        finally:
+            watcher.cancel()
+            loop.run_until_complete(asyncio.sleep(0))
+            loop.close()
+            database.rollback()
+            database.drop_fork(1)
+            database.commit()
+            database.disconnect()
+
+
+class _Request(object):
+    def __init__(self, path):
+        self.path = path
+        self.query = {}
+
+
+def _make_block_events(block_num, changes):
+    return [
+        Event(
+            event_type='sawtooth/block-commit',
+            attributes=[
+                Event.Attribute(key='block_num', value=str(block_num)),
+                Event.Attribute(
+                    key='block_id', value='block-{}'.format(block_num)),
+            ]),
+        Event(
+            event_type='sawtooth/state-delta',
+            data=StateChangeList(state_changes=[
+                StateChange(
+                    address=address, value=data, type=StateChange.SET)
+                for address, data in sorted(changes.items())
+            ]).SerializeToString()),
+    ]
@@ -299,6 +299,81 @@ class SimpleSupplyTest(unittest.TestCase):
             "INVALID",
             "Longitude must be between -180 and 180. Got -181")
 
+    def test_05_batch_update(self):
+        """ Tests the BatchUpdateAction validation rules.
+
+        Notes:
+            BatchUpdateAction validation rules:
+                - At least one update or transfer is provided
+                - Every update and transfer is valid on its own
+                - Updates are applied before transfers
+        """
+        for record_id in ('batch1', 'batch2'):
+            self.client.create_record(
+                key=self.signer1,
+                latitude=0,
+                longitude=0,
+                record_id=record_id,
+                timestamp=0)
+
+        self.assertEqual(
+            self.client.batch_update(
+                key=self.signer1,
+                updates=[],
+                transfers=[],
+                timestamp=1)[0]['status'],
+            "INVALID",
+            "No record updates or transfers provided")
+
+        self.assertEqual(
+            self.client.batch_update(
+                key=self.signer1,
+                updates=[
+                    {'record_id': 'batch1', 'latitude': 1, 'longitude': 1},
+                    {'record_id': 'batch2', 'latitude': 1, 'longitude': 1},
+                    {'record_id': 'batch1', 'latitude': 2, 'longitude': 2}
+                ],
+                transfers=[],
+                timestamp=2)[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.batch_update(
+                key=self.signer1,
+                updates=[
+                    {'record_id': 'batch1', 'latitude': 3, 'longitude': 3},
+                    {'record_id': 'notarecord', 'latitude': 3, 'longitude': 3}
+                ],
+                transfers=[],
+                timestamp=3)[0]['status'],
+            "INVALID",
+            "Record with the record id notarecord does not exist")
+
+        self.assertEqual(
+            self.client.batch_update(
+                key=self.signer1,
+                updates=[
+                    {'record_id': 'batch1', 'latitude': 4, 'longitude': 4}
+                ],
+                transfers=[{
+                    'record_id': 'batch1',
+                    'receiving_agent': self.signer2.get_public_key().as_hex()
+                }],
+                timestamp=4)[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.batch_update(
+                key=self.signer1,
+                updates=[
+                    {'record_id': 'batch1', 'latitude': 5, 'longitude': 5},
+                    {'record_id': 'batch2', 'latitude': 5, 'longitude': 5}
+                ],
+                transfers=[],
+                timestamp=5)[0]['status'],
+            "INVALID",
+            "Transaction signer is not the owner of the record")
+
 class SimpleSupplyClient(object):
 
     def __init__(self, url):
@@ -353,6 +428,18 @@ class SimpleSupplyClient(object):
         self._client.send_batches(batch_list)
         return self._client.get_statuses([batch_id], wait=10)
 
+    def batch_update(self, key, updates, transfers, timestamp):
+        batch = transaction_creation.make_batch_update_transaction(
+            transaction_signer=key,
+            batch_signer=BATCH_KEY,
+            updates=updates,
+            transfers=transfers,
+            timestamp=timestamp)
+        batch_id = batch.header_signature
+        batch_list = batch_pb2.BatchList(batches=[batch])
+        self._client.send_batches(batch_list)
+        return self._client.get_statuses([batch_id], wait=10)
+
 def wait_until_status(url, status_code=200, tries=5):
     """Pause the program until the given url returns the required status.
 